@@ -4,9 +4,13 @@
 # See the LICENSE for more information.
 from __future__ import (print_function, division, absolute_import, unicode_literals)
 
+import os
+
 from django.core.cache import get_cache, InvalidCacheBackendError, cache as default_cache
 from django.utils.functional import SimpleLazyObject
 
+from facets.utils import atomic_write
+
 
 def facets_cache():
     try:
@@ -16,3 +20,52 @@ def facets_cache():
 
 
 cache = SimpleLazyObject(facets_cache)
+
+
+class DiskCache(object):
+    """
+    A directory of files addressed by key. Once its size goes over ``max_size`` bytes,
+    ``cull()`` removes least recently used files.
+    """
+    def __init__(self, location, max_size):
+        self.location = location
+        self.max_size = max_size
+
+    def path(self, key):
+        return os.path.join(self.location, key[:2], key)
+
+    def get(self, key):
+        filename = self.path(key)
+        try:
+            with open(filename, 'rb') as fp:
+                data = fp.read()
+            os.utime(filename, None)
+        except (IOError, OSError):
+            return None
+
+        return data
+
+    def set(self, key, data):
+        atomic_write(self.path(key), data)
+
+    def cull(self):
+        files = []
+        for directory, _ds, filenames in os.walk(self.location):
+            for filename in filenames:
+                filename = os.path.join(directory, filename)
+                try:
+                    st = os.stat(filename)
+                except OSError:
+                    continue
+                files.append((st.st_mtime, st.st_size, filename))
+
+        size = sum([x[1] for x in files])
+        for mtime, file_size, filename in sorted(files):
+            if size <= self.max_size:
+                break
+
+            try:
+                os.unlink(filename)
+            except OSError:
+                pass
+            size -= file_size
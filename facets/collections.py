@@ -16,6 +16,7 @@ from django.contrib.staticfiles.storage import staticfiles_storage
 from django import template
 from django.utils.encoding import force_str
 
+from facets.index import file_stat
 from facets.utils import UrlsNormalizer
 
 
@@ -50,6 +51,7 @@ class MediaCollection(object):
     def __init__(self, data, path):
         parser = html5lib.HTMLParser(tree=treebuilders.getTreeBuilder("dom"))
         node = parser.parseFragment(data)
+        self.data = data
         self.node = node
         self.path = path
         self.init_collection()
@@ -130,29 +132,35 @@ class MediaCollection(object):
 
         self.media.append(src)
 
-    def get_html(self):
+    def get_html(self, url=None):
+        url = url or staticfiles_storage.url(self.path)
+
         if self.type == 'link':
-            return self.get_html_link()
+            return self.get_html_link(url)
         elif self.type == 'script':
-            return self.get_html_script()
+            return self.get_html_script(url)
 
-    def get_html_link(self):
+    def get_html_link(self, url):
         attrs = dict(self.attrs)
-        attrs['href'] = staticfiles_storage.url(self.path)
+        attrs['href'] = url
         tag = '<link %s />'
         return tag % ' '.join(
             ['%s="%s"' % (k, _attr_data(v)) for k, v in attrs.items()]
         )
 
-    def get_html_script(self):
+    def get_html_script(self, url):
         attrs = dict(self.attrs)
-        attrs['src'] = staticfiles_storage.url(self.path)
+        attrs['src'] = url
         tag = '<script %s></script>'
         return tag % ' '.join(
             ['%s="%s"' % (k, _attr_data(v)) for k, v in attrs.items()]
         )
 
-    def get_data(self):
+    def get_data(self, css_urls=None):
+        """
+        Returns the concatenated contents of collection media. ``css_urls`` is an optional
+        ``CssUrlsIndex`` of already scanned CSS contents.
+        """
         out = StringIO()
 
         for x in self.media:
@@ -166,7 +174,8 @@ class MediaCollection(object):
                 data = force_str(fp.read())
 
                 if self.type == "link" and self.attrs.get("type") == "text/css":
-                    data = UrlsNormalizer().normalize(data, os.path.dirname(path))
+                    urls = css_urls.get(data) if css_urls is not None else None
+                    data = UrlsNormalizer().normalize(data, os.path.dirname(path), urls)
                 elif self.type == "script":
                     data = "(function() {\n%s\n})();" % data
 
@@ -188,7 +197,15 @@ def get_loaders():
     return list(chain(settings.TEMPLATE_LOADERS))
 
 
-def parse_templates():
+def parse_templates(template_cache=None):
+    """
+    Yields the set of collections found in each template. When provided, ``template_cache`` is
+    a dictionary of collections by template path, used for templates that did not change. It is
+    updated with parsed templates.
+
+    Collections of a template only come from its own nodes, not from templates it includes or
+    extends (these are parsed on their own), so a template is parsed again only when it changes.
+    """
     # Most parts of this code comes from django assets
     #
     template_dirs = []
@@ -200,15 +217,42 @@ def parse_templates():
         from django.template.loaders.app_directories import app_template_dirs
         template_dirs.extend(app_template_dirs)
 
+    seen = set()
     for template_dir in template_dirs:
         for directory, _ds, files in os.walk(template_dir):
             for filename in files:
                 if filename.endswith('.html'):
                     tmpl_path = os.path.join(directory, filename)
+                    seen.add(tmpl_path)
+                    if template_cache is None:
+                        try:
+                            yield parse_template(tmpl_path)
+                        except Exception as e:
+                            yield e
+                        continue
+
+                    stat = file_stat(tmpl_path)
+                    entry = template_cache.get(tmpl_path)
+                    if entry is not None and entry['stat'] == stat:
+                        yield set([
+                            MediaCollection(data, path) for path, data in entry['collections']
+                        ])
+                        continue
+
                     try:
-                        yield parse_template(tmpl_path)
+                        result = parse_template(tmpl_path)
                     except Exception as e:
                         yield e
+                    else:
+                        template_cache[tmpl_path] = {
+                            'stat': stat,
+                            'collections': sorted([(x.path, x.data) for x in result]),
+                        }
+                        yield result
+
+    # Forget removed templates
+    for tmpl_path in set(template_cache or {}) - seen:
+        del template_cache[tmpl_path]
 
 
 def parse_template(tmpl_path):
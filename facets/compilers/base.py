@@ -5,12 +5,39 @@
 from __future__ import (print_function, division, absolute_import, unicode_literals)
 
 from datetime import datetime
+import hashlib
+import json
 import os.path
+import re
+from tempfile import mkstemp
+import time
 
 from django.core.files.base import ContentFile
-from django.utils.encoding import smart_str
+from django.utils.encoding import force_bytes, smart_str
 
-from facets.utils import CommandHandlerMixin
+from facets.cache import DiskCache
+from facets.conf import settings
+from facets.index import file_md5
+from facets.utils import CommandHandlerMixin, _umask, atomic_write, file_lock
+from facets.version import __version__
+
+
+# Files imported by each compiled file, recorded on compilation (None when some are unknown)
+_imports = {}
+
+# Results of recent should_compile() calls, by compiled file: (expiration time, result)
+_checks = {}
+
+
+# First name of a part of an import statement: quoted, in url() or bare
+RE_IMPORT_NAME = re.compile(r'^\s*(?:url\(\s*)?(["\']?)([^"\'\s(),;]+)\1')
+
+
+def get_compiler_cache():
+    if not settings.FACETS_COMPILER_CACHE:
+        return None
+
+    return DiskCache(settings.FACETS_COMPILER_CACHE, settings.FACETS_COMPILER_CACHE_SIZE)
 
 
 class CompilerError(Exception):
@@ -23,10 +50,17 @@ class Compiler(object):
     new_name = '{base}.{extension}'
     remove_original = True
 
+    # Regular expression matching import statements in source files, its only group being the
+    # comma separated list of imported names
+    import_pattern = None
+    # Extensions tried for imported names without extension
+    import_extensions = tuple()
+
     def __init__(self, original, storage, path, **options):
         self.original = original
         self.storage = storage
         self.path = path
+        self.options = options
         self.__dict__.update(options)
 
         base, extension = os.path.splitext(self.path)
@@ -39,12 +73,161 @@ class Compiler(object):
         """
         raise NotImplementedError()
 
+    def run(self):
+        """
+        Compiles file, or restores a previous result from compiler cache when the original file
+        and all its imports did not change. Files with unknown imports are always compiled.
+        Returns the new relative path of saved file.
+        """
+        dependencies, complete = self.find_dependencies()
+
+        cache = get_compiler_cache()
+        if cache is None or not complete:
+            new_name = self.compile()
+        else:
+            key = self.get_cache_key(dependencies)
+            data = cache.get(key)
+            if data is not None:
+                self.save_contents(data)
+                new_name = self.new_name
+            else:
+                new_name = self.compile()
+                with self.storage.open(new_name, 'rb') as fp:
+                    cache.set(key, fp.read())
+
+        # Record imports of this compilation, file is up to date
+        _imports[self.original] = dependencies if complete else None
+        _checks[self.new_name] = (time.time() + settings.FACETS_COMPILE_CHECK_TTL, False)
+
+        return new_name
+
+    def get_cache_key(self, dependencies):
+        options = json.dumps(sorted(self.options.items()), sort_keys=True, default=repr)
+        hashes = sorted([file_md5(x) for x in dependencies])
+
+        return hashlib.sha1(force_bytes('\n'.join([
+            __version__, self.__class__.__module__, self.__class__.__name__, options,
+            settings.STATIC_URL, self.path, file_md5(self.original)
+        ] + hashes))).hexdigest()
+
+    def get_import_paths(self, filename):
+        """
+        Returns directories where names imported by ``filename`` are looked up.
+        """
+        from facets.finders import get_base_finders_locations
+        return [os.path.dirname(filename)] + list(get_base_finders_locations())
+
+    def resolve_import(self, name, filename):
+        """
+        Returns every existing file that ``name``, imported by ``filename``, could refer to.
+        """
+        names = [name]
+        if not os.path.splitext(name)[1]:
+            names = ['{0}.{1}'.format(name, x) for x in self.import_extensions]
+
+        # Partials (Sass)
+        names.extend([
+            os.path.join(os.path.dirname(x), '_' + os.path.basename(x)) for x in names
+        ])
+
+        result = []
+        for directory in self.get_import_paths(filename):
+            for x in names:
+                path = os.path.join(directory, x)
+                if os.path.isfile(path):
+                    result.append(os.path.normpath(path))
+
+        return result
+
+    def get_imports(self, contents):
+        """
+        Returns the names imported by ``contents``, every name of import statements listing
+        several ones.
+        """
+        names = []
+        for statement in re.findall(self.import_pattern, contents):
+            for part in statement.split(','):
+                m = RE_IMPORT_NAME.match(part)
+                m and names.append(m.group(2))
+
+        return names
+
+    def find_dependencies(self):
+        """
+        Returns the sorted list of files imported, directly or not, by original file, and a flag
+        telling if this list is complete: False when there is no ``import_pattern`` or when an
+        imported name could not be resolved to a file.
+        """
+        if self.import_pattern is None:
+            return [], False
+
+        result = set()
+        complete = True
+        pending = [self.original]
+        while pending:
+            filename = pending.pop()
+            try:
+                with open(filename, 'rb') as fp:
+                    contents = fp.read().decode('utf-8', 'replace')
+            except IOError:
+                complete = False
+                continue
+
+            for name in self.get_imports(contents):
+                paths = self.resolve_import(name, filename)
+                complete = complete and bool(paths)
+                for path in paths:
+                    if path not in result and path != self.original:
+                        result.add(path)
+                        pending.append(path)
+
+        return sorted(result), complete
+
+    def get_dependencies(self):
+        """
+        Returns the sorted list of known files imported, directly or not, by original file.
+        """
+        return self.find_dependencies()[0]
+
     def save_contents(self, contents):
-        out = ContentFile(smart_str(contents))
-        self.storage.exists(self.new_name) and self.storage.delete(self.new_name)
-        self.storage.save(self.new_name, out)
+        try:
+            filename = self.storage.path(self.new_name)
+        except NotImplementedError:
+            out = ContentFile(smart_str(contents))
+            self.storage.exists(self.new_name) and self.storage.delete(self.new_name)
+            self.storage.save(self.new_name, out)
+        else:
+            # Replace file atomically, readers never get a partial file
+            permissions = settings.FILE_UPLOAD_PERMISSIONS
+            atomic_write(filename, smart_str(contents),
+                         permissions if permissions is not None else 0o666 & ~_umask)
+
+    def lock(self):
+        """
+        Returns a context manager holding an exclusive lock on compiled file, shared by threads
+        and processes.
+        """
+        try:
+            return file_lock(self.storage.path(self.new_name))
+        except NotImplementedError:
+            return file_lock(self.new_name)
 
-    def should_compile(self):
+    def should_compile(self, force=False):
+        """
+        Tells whether compiled file is missing or older than original file or one of its
+        imports. Result is kept for ``FACETS_COMPILE_CHECK_TTL`` seconds, unless ``force`` is
+        set.
+        """
+        now = time.time()
+        expires, result = _checks.get(self.new_name, (0, None))
+        if not force and expires > now and (result or self.storage.exists(self.new_name)):
+            return result
+
+        result = self.check_modified()
+        _checks[self.new_name] = (now + settings.FACETS_COMPILE_CHECK_TTL, result)
+        return result
+
+    def check_modified(self):
         if not self.storage.exists(self.new_name):
             return True
 
@@ -55,6 +238,20 @@ class Compiler(object):
         if otime > mtime:
             return True
 
+        # Check imported files only when they are all known
+        if self.original not in _imports:
+            dependencies, complete = self.find_dependencies()
+            _imports[self.original] = dependencies if complete else None
+
+        if _imports[self.original] is not None:
+            for filename in _imports[self.original]:
+                try:
+                    if datetime.fromtimestamp(os.path.getmtime(filename)) > mtime:
+                        return True
+                except OSError:
+                    return True
+            return False
+
         # Check for other static files
         from facets.finders import get_base_finders
         for finder in get_base_finders():
@@ -67,4 +264,24 @@ class Compiler(object):
 
 
 class CommandCompiler(Compiler, CommandHandlerMixin):
-    pass
+    def execute_cmd_to_file(self, **kwargs):
+        """
+        Runs a command writing compiled file to ``{outfile}``. Command writes a temporary file
+        next to compiled file, renamed once complete: readers never get a partial file.
+        """
+        filename = self.storage.path(self.new_name)
+        directory = os.path.dirname(filename)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        suffix = os.path.splitext(filename)[1]
+        fd, tmp_name = mkstemp(prefix='.facets-', suffix=suffix, dir=directory)
+        os.close(fd)
+        try:
+            self.execute_cmd(outfile=tmp_name, **kwargs)
+            permissions = settings.FILE_UPLOAD_PERMISSIONS
+            os.chmod(tmp_name, permissions if permissions is not None else 0o666 & ~_umask)
+            os.rename(tmp_name, filename)
+        except Exception:
+            os.path.exists(tmp_name) and os.unlink(tmp_name)
+            raise
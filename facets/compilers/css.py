@@ -18,19 +18,25 @@ class LessCompiler(CommandCompiler):
     check_extensions = ('.css',) + extensions
     new_name = '{base}.css'
 
+    import_pattern = r'@import\s*(?:\([^)]*\)\s*)?(url\([^)]*\)|["\'][^"\']*["\'])'
+    import_extensions = extensions
+
     program = '/usr/bin/env lessc'
-    command = '{program} {options} {infile} {outfile}'
+    command = '{program} {options} {infile}'
 
     def compile(self):
-        outfile = self.storage.path(self.new_name)
-
         locations = list(get_base_finders_locations())
-        options = (
+        options = ' '.join((
             '--include-path={0}'.format(':'.join(reversed(locations))),
             '--global-var=\'STATIC_URL="{0}"\''.format(settings.STATIC_URL)
-        )
+        ))
+
+        # Commands writing an {outfile} are still supported
+        if '{outfile}' in self.command:
+            self.execute_cmd_to_file(infile=self.original, options=options)
+        else:
+            self.save_contents(self.execute_cmd(infile=self.original, options=options))
 
-        self.execute_cmd(infile=self.original, outfile=outfile, options=' '.join(options))
         return self.new_name
 
 
@@ -39,6 +45,10 @@ class SasscCompiler(CommandCompiler):
     check_extensions = ('.css',) + extensions
     new_name = '{base}.css'
 
+    # Lists may go on next lines after a comma (indented syntax has no semicolons)
+    import_pattern = r'@import\s+((?:[^;\n]*,\s*\n)*[^;\n]*)'
+    import_extensions = extensions
+
     program = '/usr/bin/env sassc'
     command = '{program} {options}'
 
@@ -63,6 +73,9 @@ class LibSassCompiler(Compiler):
     check_extensions = ('.css',) + extensions
     new_name = '{base}.css'
 
+    import_pattern = SasscCompiler.import_pattern
+    import_extensions = extensions
+
     def compile(self):
         try:
             import sass
@@ -92,6 +105,9 @@ class StylusCompiler(CommandCompiler):
     check_extensions = ('.css',) + extensions
     new_name = '{base}.css'
 
+    import_pattern = r'@(?:import|require)\s+([^;\n]+)'
+    import_extensions = extensions
+
     program = '/usr/bin/env stylus'
     command = '{program} -p {options}'
 
@@ -37,8 +37,12 @@ class LiveScriptCompiler(CommandCompiler):
 
 class DartCompiler(CommandCompiler):
     extensions = ('dart',)
+    check_extensions = ('.dart',)
     new_name = '{base}.js'
 
+    # Libraries and parts, but SDK libraries
+    import_pattern = r'(?m)^\s*(?:import|export|part)\s+(["\'](?!dart:)[^"\']*["\'])'
+
     program = '/usr/bin/env dart2js'
     command = '{program} -o {outfile} {infile}'
 
@@ -11,7 +11,31 @@ DEFAULTS = {
 
     'FACETS_HANDLERS': (
         'facets.processors.css.CssUrlsProcessor',
-    )
+    ),
+
+    'FACETS_WORKERS': 1,
+    'FACETS_WORKER_POOL_SIZE': None,
+
+    'FACETS_COMMAND_TIMEOUT': None,
+    'FACETS_MAX_PROCESSES': None,
+
+    'FACETS_INDEX_DIR': None,
+
+    'FACETS_MANIFEST': 'facets.json',
+    'FACETS_MANIFEST_CACHE': False,
+    'FACETS_MANIFEST_SHARDS': 64,
+    'FACETS_MANIFEST_CHECK_INTERVAL': 5,
+
+    'FACETS_PROCESSOR_CACHE': None,
+    'FACETS_PROCESSOR_CACHE_SIZE': 256 * 1024 * 1024,
+
+    'FACETS_COMPILER_CACHE': None,
+    'FACETS_COMPILER_CACHE_SIZE': 256 * 1024 * 1024,
+
+    'FACETS_COMPILE_CHECK_TTL': 1,
+
+    'FACETS_WATCH': False,
+    'FACETS_WATCH_INTERVAL': 1,
 }
 
 
@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of Django facets released under the MIT license.
+# See the LICENSE for more information.
+from __future__ import (print_function, division, absolute_import, unicode_literals)
+
+import re
+
+# Tokens that are never minified: comments, URLs and strings. Text between them is minified.
+TOKENS = re.compile(r"""
+    (?P<comment>/\*.*?\*/)
+    |(?P<url>url\(\s*(?P<quote>["']?)(?P<url_value>.*?)(?P=quote)\s*\))
+    |(?P<import>@import\s*(?P<import_quote>["'])\s*(?P<import_value>.*?)(?P=import_quote))
+    |(?P<string>"(?:\\.|[^"\\])*"|'(?:\\.|[^'\\])*')
+""", re.S | re.X)
+
+URL_REPL = 'url("{new}")'
+IMPORT_REPL = '@import url("{new}")'
+
+# No space is needed after / before these characters
+NO_SPACE_AFTER = frozenset('{};:,>(')
+NO_SPACE_BEFORE = frozenset('{};,>)')
+
+RE_SPACES = re.compile(r'\s+')
+
+# Joins texts minified together, never found in CSS
+SEPARATOR = '\x00'
+
+
+def is_name_char(c):
+    """
+    Returns True if ``c`` can be part of a name or a number, so that two of them are not joined.
+    """
+    return c.isalnum() or c in '-_'
+
+
+def minify_text(text):
+    """
+    Removes useless white spaces of CSS ``text`` without comments nor strings.
+    """
+    # Plain replacements are much faster than regular expressions with groups
+    text = RE_SPACES.sub(' ', text)
+    for c in NO_SPACE_AFTER:
+        text = text.replace(c + ' ', c)
+    for c in NO_SPACE_BEFORE:
+        text = text.replace(' ' + c, c)
+
+    return text.replace(';}', '}')
+
+
+def optimize(content, location='', normalizer=None, minify=True):
+    """
+    Rewrites URLs of CSS ``content`` with ``normalizer`` (a ``facets.utils.UrlsNormalizer``
+    instance), when set, and removes comments and useless white spaces when ``minify`` is set,
+    in a single pass. Comments starting with ``/*!`` are kept. A removed comment between two
+    names or numbers (``1px/**/2px``) is replaced by a space so that they are not joined.
+    """
+    if normalizer is not None:
+        normalizer.set_location(location)
+
+    result = []
+
+    def append(text, separate=False):
+        # Join minified parts without useless white spaces
+        if result:
+            last = result[-1]
+            if separate and is_name_char(last[-1]) and is_name_char(text[0]):
+                result.append(' ')
+            elif text[0] == ' ' and (last[-1] in NO_SPACE_AFTER or last.endswith(('*/', ' '))):
+                text = text[1:]
+            elif text[0] in NO_SPACE_BEFORE and last[-1] == ' ' or \
+                    text[0] == '}' and last[-1] == ';':
+                result[-1] = last[:-1]
+                result[-1] or result.pop()
+        elif text[0] == ' ':
+            text = text[1:]
+
+        text and result.append(text)
+
+    texts = []
+    values = []
+    offset = 0
+    for m in TOKENS.finditer(content):
+        texts.append(content[offset:m.start()])
+        offset = m.end()
+
+        kind = m.lastgroup
+        value = m.group(0)
+        if kind == 'comment':
+            if minify and not value.startswith('/*!'):
+                value = None  # Removed
+        elif normalizer is not None and kind == 'url':
+            value = normalizer.replace(value, m.group('url_value').strip(), URL_REPL)
+        elif normalizer is not None and kind == 'import':
+            value = normalizer.replace(value, m.group('import_value').strip(), IMPORT_REPL)
+
+        values.append(value)
+
+    texts.append(content[offset:])
+    values.append('')
+
+    if not minify:
+        return ''.join([x for pair in zip(texts, values) for x in pair])
+
+    # Texts are minified at once, much faster than one call per text
+    if SEPARATOR not in content:
+        texts = minify_text(SEPARATOR.join(texts)).split(SEPARATOR)
+    else:
+        texts = [minify_text(x) for x in texts]
+
+    separate = False  # Whether a comment was removed since last appended part
+    for text, value in zip(texts, values):
+        for part in (text, value):
+            if part:
+                append(part, separate)
+                separate = False
+
+        separate = separate or value is None
+
+    return ''.join(result).rstrip()
@@ -62,10 +62,13 @@ class FacetsFinder(BaseStorageFinder):
         if compiler is None:
             return all and [original] or original
 
-        if not compiler.should_compile():
-            return self.storage.path(compiler.new_name)
+        if compiler.should_compile():
+            # Single flight: concurrent callers wait for the running compilation
+            with compiler.lock():
+                if compiler.should_compile(force=True):
+                    compiler.run()
 
-        full_path = compiler.storage.path(compiler.compile())
+        full_path = compiler.storage.path(compiler.new_name)
         return all and [full_path] or full_path
 
     def list(self, ignore_patterns):
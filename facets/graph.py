@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of Django facets released under the MIT license.
+# See the LICENSE for more information.
+from __future__ import (print_function, division, absolute_import, unicode_literals)
+
+from facets.index import PersistentIndex
+
+
+def get_components(keys, dependencies):
+    """
+    Returns the strongly connected components (dependency cycles, or single keys) of ``keys``
+    and their ``dependencies`` (a dictionary of dependency lists by key), as sorted lists. Each
+    component comes after the components it depends on.
+    """
+    keys = set(keys)
+
+    def _dependencies(key):
+        return iter(sorted([x for x in dependencies.get(key, []) if x in keys]))
+
+    # Tarjan's algorithm, without recursion
+    index = {}
+    lowlink = {}
+    stack = []
+    on_stack = set()
+    components = []
+    for root in sorted(keys):
+        if root in index:
+            continue
+
+        index[root] = lowlink[root] = len(index)
+        stack.append(root)
+        on_stack.add(root)
+        work = [(root, _dependencies(root))]
+        while work:
+            key, children = work[-1]
+            for child in children:
+                if child not in index:
+                    index[child] = lowlink[child] = len(index)
+                    stack.append(child)
+                    on_stack.add(child)
+                    work.append((child, _dependencies(child)))
+                    break
+                elif child in on_stack:
+                    lowlink[key] = min(lowlink[key], index[child])
+            else:
+                work.pop()
+                if work:
+                    parent = work[-1][0]
+                    lowlink[parent] = min(lowlink[parent], lowlink[key])
+
+                if lowlink[key] == index[key]:
+                    component = []
+                    while not component or component[-1] != key:
+                        component.append(stack.pop())
+                        on_stack.discard(component[-1])
+                    components.append(sorted(component))
+
+    return components
+
+
+def sort_levels(keys, dependencies):
+    """
+    Groups ``keys`` in levels, every key coming after its ``dependencies`` (a dictionary of
+    dependency lists by key). Keys of a dependency cycle share a level, keys depending on a
+    cycle come after it.
+    """
+    key_levels = {}
+    levels = []
+    for component in get_components(keys, dependencies):
+        level = 0
+        for key in component:
+            for x in dependencies.get(key, []):
+                if x in key_levels and x not in component:
+                    level = max(level, key_levels[x] + 1)
+
+        for key in component:
+            key_levels[key] = level
+
+        while len(levels) <= level:
+            levels.append([])
+        levels[level].extend(component)
+
+    return [sorted(x) for x in levels]
+
+
+class DependencyGraph(PersistentIndex):
+    """
+    Relations between static files, kept between collectstatic runs:
+
+    - ``collections``: static files of each collection
+    - ``templates``: collections found in each template, with the template stat
+    """
+    name = 'graph'
+    sections = ('collections', 'templates')
+
+    def load(self):
+        super(DependencyGraph, self).load()
+        for name in self.sections:
+            self.setdefault(name, {})
+
+    def get_collections(self, keys):
+        """
+        Returns the path of every collection containing one of ``keys``.
+        """
+        keys = set(keys)
+        return set([k for k, v in self['collections'].items() if keys.intersection(v)])
@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of Django facets released under the MIT license.
+# See the LICENSE for more information.
+from __future__ import (print_function, division, absolute_import, unicode_literals)
+
+import hashlib
+import json
+import os.path
+
+from facets.cache import cache
+from facets.conf import settings
+from facets.utils import atomic_write
+
+
+def file_md5(filename):
+    md5 = hashlib.md5()
+    with open(filename, 'rb') as fp:
+        for chunk in iter(lambda: fp.read(64 * 1024), b''):
+            md5.update(chunk)
+
+    return md5.hexdigest()
+
+
+def file_stat(filename):
+    """
+    Returns a (size, mtime, inode) list for ``filename`` or None if it does not exist.
+    """
+    try:
+        st = os.stat(filename)
+    except OSError:
+        return None
+
+    return [st.st_size, st.st_mtime, st.st_ino]
+
+
+class PersistentIndex(dict):
+    """
+    A dictionary kept between collectstatic runs. It is stored as a JSON file in
+    ``FACETS_INDEX_DIR`` when this setting is set, in facets cache otherwise.
+    """
+    name = None
+
+    def __init__(self):
+        super(PersistentIndex, self).__init__()
+        self.load()
+
+    @property
+    def cache_key(self):
+        return 'facets:{0}'.format(self.name)
+
+    @property
+    def filename(self):
+        if not settings.FACETS_INDEX_DIR:
+            return None
+
+        return os.path.join(settings.FACETS_INDEX_DIR, '{0}.json'.format(self.name))
+
+    def load(self):
+        self.clear()
+
+        if self.filename is None:
+            self.update(cache.get(self.cache_key, {}))
+            return
+
+        try:
+            with open(self.filename, 'rb') as fp:
+                self.update(json.loads(fp.read().decode('utf-8')))
+        except (IOError, ValueError):
+            pass
+
+    def save(self):
+        if self.filename is None:
+            # Never expires (Django 1.6+)
+            cache.set(self.cache_key, dict(self), None)
+        else:
+            atomic_write(self.filename, json.dumps(self, separators=(',', ':')))
+
+
+class HashIndex(PersistentIndex):
+    """
+    MD5 hashes of source files, keyed by their absolute path. An entry is valid as long as the
+    file keeps the same size, mtime and inode.
+    """
+    name = 'hashes'
+
+    def __init__(self):
+        super(HashIndex, self).__init__()
+        self.used = set()
+
+    def get_entry(self, filename):
+        """
+        Returns the entry of ``filename`` if the file did not change since it was indexed.
+        """
+        entry = self.get(filename)
+        if entry is None or entry['stat'] != file_stat(filename):
+            return None
+
+        self.used.add(filename)
+        return entry
+
+    def set_entry(self, filename, md5, stat=None, **extra):
+        """
+        Sets ``filename`` hash. Extra values are kept while the hash does not change.
+        """
+        stat = stat or file_stat(filename)
+        if stat is None:
+            return
+
+        entry = self.get(filename)
+        if entry is None or entry['md5'] != md5:
+            entry = {}
+
+        entry.update(extra, stat=stat, md5=md5)
+        self[filename] = entry
+        self.used.add(filename)
+
+    def prune(self):
+        """
+        Removes entries that were not used since the index was loaded.
+        """
+        for filename in set(self.keys()) - self.used:
+            del self[filename]
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of Django facets released under the MIT license.
+# See the LICENSE for more information.
+from __future__ import (print_function, division, absolute_import, unicode_literals)
+
+from optparse import make_option
+
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.core.management.base import NoArgsCommand, CommandError
+
+from facets.finders import get_base_finders
+from facets.handlers import default_handlers
+from facets.index import HashIndex, file_md5, file_stat
+
+
+class Command(NoArgsCommand):
+    help = 'Verifies or rebuilds the hash index used by collectstatic.'
+    option_list = NoArgsCommand.option_list + (
+        make_option('--rebuild', action='store_true', dest='rebuild', default=False,
+                    help='Hash every static file again and replace the index.'),
+    )
+
+    def handle_noargs(self, **options):
+        if options['rebuild']:
+            self.rebuild()
+        else:
+            self.verify()
+
+    def get_filenames(self):
+        """
+        Lists local filenames of all static files, including compiled ones.
+        """
+        for finder in get_base_finders():
+            for path, storage in finder.list(['CVS', '.*', '*~']):
+                try:
+                    yield storage.path(path)
+                except NotImplementedError:
+                    continue
+
+                compiler = default_handlers.get_compiler(None, staticfiles_storage, path)
+                if compiler and staticfiles_storage.exists(compiler.new_name):
+                    yield staticfiles_storage.path(compiler.new_name)
+
+    def rebuild(self):
+        index = HashIndex()
+        index.clear()
+
+        for filename in self.get_filenames():
+            stat = file_stat(filename)
+            index.set_entry(filename, file_md5(filename), stat)
+
+        index.save()
+        self.stdout.write('{0} files indexed.'.format(len(index)))
+
+    def verify(self):
+        index = HashIndex()
+        invalid = 0
+        outdated = 0
+
+        for filename, entry in sorted(index.items()):
+            if index.get_entry(filename) is None:
+                outdated += 1
+            elif file_md5(filename) != entry['md5']:
+                invalid += 1
+                self.stderr.write('Invalid hash for {0}'.format(filename))
+
+        self.stdout.write('{0} files indexed, {1} outdated, {2} invalid.'.format(
+            len(index), outdated, invalid
+        ))
+
+        if invalid:
+            raise CommandError('Hash index is invalid, please run with --rebuild.')
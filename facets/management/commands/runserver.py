@@ -0,0 +1,18 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of Django facets released under the MIT license.
+# See the LICENSE for more information.
+from __future__ import (print_function, division, absolute_import, unicode_literals)
+
+from django.contrib.staticfiles.management.commands.runserver import Command as BaseCommand
+
+from facets.conf import settings
+
+
+class Command(BaseCommand):
+    def inner_run(self, *args, **options):
+        if settings.FACETS_WATCH and not settings.FACETS_ENABLED:
+            from facets.watcher import Watcher
+            Watcher().start()
+
+        super(Command, self).inner_run(*args, **options)
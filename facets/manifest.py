@@ -0,0 +1,341 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of Django facets released under the MIT license.
+# See the LICENSE for more information.
+from __future__ import (print_function, division, absolute_import, unicode_literals)
+
+from array import array
+from binascii import hexlify, unhexlify
+from collections import Mapping, OrderedDict
+from functools import partial
+import hashlib
+import json
+import os.path
+import re
+import threading
+
+from django.core.files.base import ContentFile
+from django.utils.encoding import force_bytes, force_text
+
+from facets.cache import cache
+from facets.conf import settings
+from facets.index import file_stat
+from facets.utils import _umask, atomic_write
+
+
+RE_DIGEST = re.compile(r'^[0-9a-f]{12}$')
+
+
+def get_shard(name, shards):
+    """
+    Returns the number of the shard holding ``name``, out of ``shards``.
+    """
+    return int(hashlib.md5(force_bytes(name)).hexdigest()[:8], 16) % shards
+
+
+class ShardCache(object):
+    """
+    Manifest shards fetched from facets cache. Least recently used shards are dropped beyond
+    ``max_size``.
+    """
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.shards = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get_many(self, keys):
+        """
+        Returns a dictionary of shards by key. Missing shards are fetched with one request,
+        shards missing from facets cache too are missing from result.
+        """
+        result = {}
+        with self.lock:
+            for key in keys:
+                if key in self.shards:
+                    result[key] = self.shards[key] = self.shards.pop(key)
+
+        missing = [x for x in keys if x not in result]
+        if missing:
+            fetched = cache.get_many(missing)
+            with self.lock:
+                for key in missing:
+                    if key in fetched:
+                        result[key] = self.shards[key] = fetched[key]
+                while len(self.shards) > self.max_size:
+                    self.shards.popitem(last=False)
+
+        return result
+
+
+# Shard keys include manifest version, shards are shared by every storage of the process
+shard_cache = ShardCache(64)
+
+
+class ShardedDict(Mapping):
+    """
+    A read only manifest section kept in facets cache as ``shards`` dictionaries, fetched on
+    demand. Every shard is stored, a missing one was evicted from cache: the section is then
+    read from ``load()``, returning it from the manifest in storage or None.
+    """
+    def __init__(self, prefix, shards, load):
+        self.prefix = prefix
+        self.shards = shards
+        self.load = load
+
+    def get_key(self, name):
+        return '{0}:{1}'.format(self.prefix, get_shard(name, self.shards))
+
+    def get_fallback(self):
+        # Not kept when missing, storage is read again on next miss
+        return self.load() or {}
+
+    def get_all(self):
+        keys = ['{0}:{1}'.format(self.prefix, x) for x in range(self.shards)]
+        shards = shard_cache.get_many(keys)
+        if len(shards) < len(keys):
+            return [self.get_fallback()]
+
+        return shards.values()
+
+    def __getitem__(self, name):
+        key = self.get_key(name)
+        shard = shard_cache.get_many([key]).get(key)
+        if shard is None:
+            shard = self.get_fallback()
+
+        return shard[name]
+
+    def __iter__(self):
+        for shard in self.get_all():
+            for name in shard:
+                yield name
+
+    def __len__(self):
+        return sum([len(x) for x in self.get_all()])
+
+
+class CompactFiles(Mapping):
+    """
+    A read only mapping of names to hashed names, built from a dictionary. A hashed name made
+    of its name and a 12 digits hash (``css/main-0123456789ab.css``) is not stored but built
+    again on lookup from 6 bytes of hash. Names are grouped by directory, each directory being
+    stored once, and sorted in a single byte string so that they are found by binary search.
+    Other hashed names are kept in a dictionary.
+    """
+    def __init__(self, files):
+        entries = []
+        self.other = {}
+        for name, hashed_name in files.items():
+            root, ext = os.path.splitext(name)
+            digest = hashed_name[len(root) + 1:len(hashed_name) - len(ext)]
+            if RE_DIGEST.match(digest) and hashed_name == '{0}-{1}{2}'.format(root, digest, ext):
+                directory, _sep, basename = name.rpartition('/')
+                entries.append((directory, force_bytes(basename), digest))
+            else:
+                self.other[name] = hashed_name
+
+        entries.sort()
+
+        # Range of entries of each directory
+        self.directories = {}
+        for i, (directory, basename, digest) in enumerate(entries):
+            start = self.directories.get(directory, (i, i))[0]
+            self.directories[directory] = (start, i + 1)
+
+        self.offsets = array(str('I'), [0])
+        for directory, basename, digest in entries:
+            self.offsets.append(self.offsets[-1] + len(basename))
+
+        self.names = b''.join([x[1] for x in entries])
+        self.digests = unhexlify(''.join([x[2] for x in entries]))
+
+    def get_basename(self, i):
+        return self.names[self.offsets[i]:self.offsets[i + 1]]
+
+    def get_hashed_name(self, name, i):
+        root, ext = os.path.splitext(force_text(name))
+        digest = hexlify(self.digests[i * 6:i * 6 + 6]).decode('ascii')
+        return '{0}-{1}{2}'.format(root, digest, ext)
+
+    def __getitem__(self, name):
+        # Names may be native strings (see FacetsFilesMixin.cache_key), bytes on Python 2
+        name = force_text(name)
+        if name in self.other:
+            return self.other[name]
+
+        directory, _sep, basename = name.rpartition('/')
+        start, last = self.directories[directory]
+
+        basename = force_bytes(basename)
+        names, offsets = self.names, self.offsets  # Local names are faster in this loop
+        end = last
+        while start < end:
+            middle = (start + end) // 2
+            if names[offsets[middle]:offsets[middle + 1]] < basename:
+                start = middle + 1
+            else:
+                end = middle
+
+        if start == last or self.get_basename(start) != basename:
+            raise KeyError(name)
+
+        return self.get_hashed_name(name, start)
+
+    def __iter__(self):
+        for name in self.other:
+            yield name
+
+        for directory, (start, end) in self.directories.items():
+            prefix = directory and directory + '/'
+            for i in range(start, end):
+                yield prefix + force_text(self.get_basename(i))
+
+    def __len__(self):
+        return len(self.other) + len(self.offsets) - 1
+
+
+class Manifest(object):
+    """
+    Mappings written by collectstatic and read by project processes: hashed names of files,
+    HTML of collections, suffixes of files created by processors next to hashed files and
+    signatures of processors applied on them.
+
+    It is stored as a compact JSON file named ``FACETS_MANIFEST`` in static files storage and,
+    when ``FACETS_MANIFEST_CACHE`` is set, in facets cache: an index key holds the version and
+    number of shards of the manifest, each section being split in ``FACETS_MANIFEST_SHARDS``
+    keys. ``stamp`` changes each time it is saved.
+    """
+    sections = ('files', 'collections', 'variants', 'processed')
+    cache_key = 'facets:manifest'
+
+    def __init__(self, data=None, stamp=None):
+        data = data or {}
+        for section in self.sections:
+            setattr(self, section, data.get(section) or {})
+
+        self.stamp = stamp
+
+    def copy(self):
+        """
+        Returns a copy made of plain dictionaries, that can be updated.
+        """
+        return self.__class__(dict([(x, dict(getattr(self, x))) for x in self.sections]),
+                              self.stamp)
+
+    def dumps(self):
+        data = dict([(x, getattr(self, x)) for x in self.sections])
+        return force_bytes(json.dumps(data, separators=(',', ':'), sort_keys=True))
+
+    @classmethod
+    def loads(cls, data, stamp=None):
+        manifest = cls(json.loads(force_bytes(data).decode('utf-8')), stamp)
+        manifest.files = CompactFiles(manifest.files)
+        return manifest
+
+    @classmethod
+    def get_stamp(cls, storage):
+        """
+        Returns the stamp of the manifest saved in ``storage`` without reading it: the size,
+        modification time and inode of a local file, the modification time of a remote one or
+        the version kept in facets cache. Returns None if there is no manifest.
+        """
+        name = settings.FACETS_MANIFEST
+        try:
+            stamp = file_stat(storage.path(name))
+        except NotImplementedError:
+            try:
+                stamp = storage.modified_time(name)
+            except (NotImplementedError, IOError, OSError):
+                stamp = None
+
+        if stamp is None and settings.FACETS_MANIFEST_CACHE:
+            index = cache.get(cls.cache_key)
+            stamp = index and index['version']
+
+        return stamp
+
+    @classmethod
+    def load(cls, storage):
+        """
+        Reads the manifest of ``storage``, from facets cache if it is missing from storage.
+        Returns an empty manifest when there is none.
+        """
+        # Stamp is taken first, a manifest saved meanwhile is loaded again later
+        stamp = cls.get_stamp(storage)
+
+        manifest = cls.load_file(storage, stamp)
+        if manifest is not None:
+            return manifest
+
+        manifest = cls(stamp=stamp)
+
+        index = settings.FACETS_MANIFEST_CACHE and cache.get(cls.cache_key) or None
+        if index is not None:
+            loaded = []
+
+            def load(section):
+                # Sections of a manifest read from storage, when shards are missing from cache
+                if not loaded:
+                    loaded.append(cls.load_file(storage))
+                    loaded[0] is None and loaded.pop()
+
+                return loaded and getattr(loaded[0], section) or None
+
+            for section in cls.sections:
+                prefix = '{0}:{1}:{2}'.format(cls.cache_key, index['version'], section)
+                setattr(manifest, section,
+                        ShardedDict(prefix, index['shards'], partial(load, section)))
+
+        return manifest
+
+    @classmethod
+    def load_file(cls, storage, stamp=None):
+        """
+        Reads the manifest file of ``storage``, returns None if it can not be read.
+        """
+        try:
+            with storage.open(settings.FACETS_MANIFEST) as fp:
+                return cls.loads(fp.read(), stamp)
+        except (IOError, OSError, ValueError):
+            return None
+
+    def save(self, storage):
+        """
+        Writes the manifest in ``storage``, atomically when storage is local.
+        """
+        data = self.dumps()
+        name = settings.FACETS_MANIFEST
+
+        try:
+            filename = storage.path(name)
+        except NotImplementedError:
+            storage.exists(name) and storage.delete(name)
+            storage.save(name, ContentFile(data))
+        else:
+            permissions = settings.FILE_UPLOAD_PERMISSIONS
+            if permissions is None:
+                permissions = 0o666 & ~_umask
+            atomic_write(filename, data, permissions)
+
+        if settings.FACETS_MANIFEST_CACHE:
+            self.save_cache(hashlib.md5(data).hexdigest())
+
+        self.stamp = self.get_stamp(storage)
+
+    def save_cache(self, version):
+        """
+        Writes the shards of every section, empty ones included, then the index pointing to them.
+        They never expire (Django 1.6+), a newer manifest uses other keys.
+        """
+        shards = settings.FACETS_MANIFEST_SHARDS
+
+        values = {}
+        for section in self.sections:
+            prefix = '{0}:{1}:{2}'.format(self.cache_key, version, section)
+            for shard in range(shards):
+                values['{0}:{1}'.format(prefix, shard)] = {}
+            for name, value in getattr(self, section).items():
+                values['{0}:{1}'.format(prefix, get_shard(name, shards))][name] = value
+
+        cache.set_many(values, None)
+        cache.set(self.cache_key, {'version': version, 'shards': shards}, None)
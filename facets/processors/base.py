@@ -4,24 +4,76 @@
 # See the LICENSE for more information.
 from __future__ import (print_function, division, absolute_import, unicode_literals)
 
+import hashlib
+import json
+import os
+from tempfile import mkstemp
+
 from django.core.files.base import ContentFile
-from django.utils.encoding import force_str, smart_str
+from django.utils.encoding import force_bytes, force_str, smart_str
 
 from facets.utils import CommandHandlerMixin
+from facets.version import __version__
 
 
 class ProcessorError(Exception):
     pass
 
 
+def save_file(storage, name, contents):
+    """
+    Replaces file ``name`` of ``storage`` by ``contents``.
+    """
+    storage.exists(name) and storage.delete(name)
+    storage.save(name, ContentFile(contents))
+
+
+def encode_result(outputs):
+    """
+    Serializes a list of (suffix, contents) tuples.
+    """
+    header = [(suffix, len(contents)) for suffix, contents in outputs]
+    return force_bytes(json.dumps(header)) + b'\n' + b''.join([x[1] for x in outputs])
+
+
+def decode_result(data):
+    """
+    Returns the list of (suffix, contents) tuples serialized by ``encode_result()``.
+    """
+    header, data = data.split(b'\n', 1)
+
+    outputs = []
+    offset = 0
+    for suffix, size in json.loads(header.decode('utf-8')):
+        outputs.append((suffix, data[offset:offset + size]))
+        offset += size
+
+    return outputs
+
+
 class Processor(object):
     match = None
     priority = 0
 
+    # Whether result only depends on processor options and file contents, so that it can be
+    # kept in processor cache
+    cacheable = False
+
+    # Whether process_contents() is implemented, so that processor runs in memory
+    in_memory = False
+
+    # Whether result is the same each time processor runs on a given hashed file, so that
+    # processor is not applied again on a hashed file it already processed
+    idempotent = False
+
     def __init__(self, media_store, storage, path, **options):
         self.media_store = media_store
         self.storage = storage
         self.path = path
+        self.options = options
+        self.outputs = {}
+        # Suffixes of files created next to processed file
+        self.suffixes = []
         self.__dict__.update(**options)
 
     def __unicode__(self):
@@ -35,17 +87,151 @@ class Processor(object):
         Process function. This function should save file to destination and return
         the relative path of saved file (or None if not changed).
         """
+        contents, new_path, _cached = self.run_contents(self.read_bytes())
+        self.save_contents(contents)
+        return new_path
+
+    def process_contents(self, contents):
+        """
+        In memory process function. This function should return processed ``contents`` and
+        put files to create next to processed file in ``self.outputs``, by suffix.
+        """
         raise NotImplementedError()
 
+    def run(self, cache=None):
+        """
+        Runs ``process()`` or, when possible, restores its previous result from ``cache`` (a
+        ``facets.cache.DiskCache`` instance). Returns the value of ``process()`` and a flag
+        telling if result comes from cache.
+        """
+        if cache is None or not self.cacheable:
+            return self.add_suffix(self.process()), False
+
+        with self.storage.open(self.path, 'rb') as fp:
+            key = self.get_cache_key(hashlib.md5(fp.read()).hexdigest())
+
+        data = cache.get(key)
+        if data is not None:
+            return self.load_result(data), True
+
+        new_path = self.process()
+        if not new_path or new_path.startswith(self.path):
+            cache.set(key, self.dump_result(new_path))
+
+        return self.add_suffix(new_path), False
+
+    def run_contents(self, contents, cache=None):
+        """
+        Runs ``process_contents()`` on ``contents`` (bytes) or restores its previous result from
+        ``cache``. Files created next to processed file are saved. Returns processed contents,
+        the path of created file if any and a flag telling if result comes from cache.
+        """
+        key = None
+        if cache is not None and self.cacheable:
+            key = self.get_cache_key(hashlib.md5(contents).hexdigest())
+            data = cache.get(key)
+            if data is not None:
+                outputs = decode_result(data)
+                return outputs[0][1], self.save_outputs(outputs[1:]), True
+
+        self.outputs = {}
+        result = force_bytes(self.process_contents(contents))
+        outputs = [('', result)] + sorted(
+            [(suffix, force_bytes(x)) for suffix, x in self.outputs.items()]
+        )
+
+        key is not None and cache.set(key, encode_result(outputs))
+        return result, self.save_outputs(outputs[1:]), False
+
+    def save_outputs(self, outputs):
+        """
+        Saves (suffix, contents) files next to processed file and returns the last path.
+        """
+        new_path = None
+        for suffix, contents in outputs:
+            new_path = self.add_suffix(self.path + suffix)
+            save_file(self.storage, new_path, contents)
+
+        return new_path
+
+    def add_suffix(self, new_path):
+        """
+        Records ``new_path`` suffix when it is a file created next to processed file.
+        """
+        if new_path and new_path != self.path and new_path.startswith(self.path):
+            suffix = new_path[len(self.path):]
+            suffix not in self.suffixes and self.suffixes.append(suffix)
+
+        return new_path
+
+    def get_cache_key(self, md5):
+        options = json.dumps(sorted(self.options.items()), sort_keys=True, default=repr)
+        return hashlib.sha1(force_bytes('\n'.join([
+            __version__, self.__class__.__module__, self.__class__.__name__, options, md5
+        ]))).hexdigest()
+
+    def get_signature(self):
+        """
+        Returns a key identifying processor class, options and version.
+        """
+        return self.get_cache_key('')
+
+    def dump_result(self, new_path):
+        """
+        Serializes processed file and new file if any.
+        """
+        outputs = [('', self.path)]
+        if new_path and new_path != self.path:
+            outputs.append((new_path[len(self.path):], new_path))
+
+        result = []
+        for suffix, name in outputs:
+            with self.storage.open(name, 'rb') as fp:
+                result.append((suffix, fp.read()))
+
+        return encode_result(result)
+
+    def load_result(self, data):
+        """
+        Saves files serialized by ``dump_result()`` and returns the new file path if any.
+        """
+        outputs = decode_result(data)
+        save_file(self.storage, self.path, outputs[0][1])
+        return self.save_outputs(outputs[1:])
+
     def read(self):
+        return force_str(self.read_bytes())
+
+    def read_bytes(self):
         with self.storage.open(self.path, 'rb') as fp:
-            return force_str(fp.read())
+            return fp.read()
 
     def save_contents(self, contents):
-        out = ContentFile(smart_str(contents))
-        self.storage.exists(self.path) and self.storage.delete(self.path)
-        self.storage.save(self.path, out)
+        save_file(self.storage, self.path, smart_str(contents))
 
 
 class CommandProcessor(Processor, CommandHandlerMixin):
-    pass
+    def execute_contents(self, contents, **kwargs):
+        """
+        Runs the command on ``contents`` and returns the result. A command without ``{infile}``
+        reads contents on its standard input and writes the result on its standard output.
+        Otherwise contents are written to a temporary file given as ``{infile}`` and
+        ``{outfile}``: the result is read from it when the command has an ``{outfile}`` or
+        writes nothing on its standard output (the file is changed in place).
+        """
+        if '{infile}' not in self.command:
+            return self.execute_cmd(data=contents, **kwargs)
+
+        fd, filename = mkstemp(prefix='facets-', suffix=os.path.splitext(self.path)[1])
+        try:
+            with os.fdopen(fd, 'wb') as fp:
+                fp.write(contents)
+
+            out = self.execute_cmd(infile=filename, outfile=filename, **kwargs)
+            if out and '{outfile}' not in self.command:
+                return out
+
+            with open(filename, 'rb') as fp:
+                return fp.read()
+        finally:
+            os.unlink(filename)
@@ -7,6 +7,9 @@ from __future__ import (print_function, division, absolute_import, unicode_liter
 import os.path
 from urlparse import urljoin
 
+from django.utils.encoding import force_str
+
+from facets.css import optimize
 from facets.processors.base import CommandProcessor, Processor, ProcessorError
 from facets.utils import UrlsNormalizer
 
@@ -29,31 +32,60 @@ class UrlsReplacer(UrlsNormalizer):
 class CssUrlsProcessor(Processor):
     match = r'\.css$'
     priority = -1000
+    # Hashed names of CSS files include the hashes of the files they link to
+    cacheable = False
+    idempotent = True
+    in_memory = True
+
+    def process_contents(self, contents):
+        contents = force_str(contents)
+
+        # Use URLs already found during collectstatic
+        css_urls = getattr(self.storage, 'css_urls', None)
+        urls = css_urls.get(contents) if css_urls is not None else None
+
+        return UrlsReplacer(self.media_store).normalize(
+            contents, os.path.dirname(self.path), urls
+        )
+
+
+class CssOptimizeProcessor(Processor):
+    match = r'\.css$'
+    priority = -1000
+    cacheable = False
+    idempotent = True
+    in_memory = True
 
-    def process(self):
-        self.save_contents(
-            UrlsReplacer(self.media_store).normalize(self.read(), os.path.dirname(self.path))
+    def process_contents(self, contents):
+        return optimize(
+            force_str(contents), os.path.dirname(self.path), UrlsReplacer(self.media_store)
         )
 
 
 class CssMinProcessor(Processor):
     match = r'\.css$'
+    cacheable = True
+    idempotent = True
+    in_memory = True
 
-    def process(self):
+    def process_contents(self, contents):
         try:
             from cssmin import cssmin
         except ImportError:
             raise ProcessorError('Unable to import cssmin module.')
 
-        self.save_contents(cssmin(self.read()))
+        return cssmin(force_str(contents))
 
 
 class YuiCssProcessor(CommandProcessor):
     match = r'\.css$'
+    cacheable = True
+    idempotent = True
+    in_memory = True
 
     program = '/usr/bin/env java -jar /path/to/yuicompressor-xxx.jar'
-    command = '{program} {infile}'
+    command = '{program} --type {file_type}'
+    file_type = 'css'
 
-    def process(self):
-        contents = self.execute_cmd(infile=self.storage.path(self.path))
-        self.save_contents(contents)
+    def process_contents(self, contents):
+        return self.execute_contents(contents, file_type=self.file_type)
@@ -5,29 +5,95 @@
 from __future__ import (print_function, division, absolute_import, unicode_literals)
 
 from gzip import GzipFile
+from io import BytesIO
+import zlib
 
 from facets.processors.base import Processor, ProcessorError
 
 
-class GZipProcessor(Processor):
-    match = r'\.(htm|html|js|css|txt|eot|ttf|svg)'
+def compress_gzip(contents, level):
+    # No file name and a null time in header, so that result only depends on contents
+    out = BytesIO()
+    with GzipFile(filename='', fileobj=out, mode='wb', compresslevel=level, mtime=0) as f_out:
+        f_out.write(contents)
+
+    return out.getvalue()
+
+
+def compress_deflate(contents, level):
+    return zlib.compress(contents, level)
+
+
+# Files are compressed once, brotli and zstd always use their best levels
+def compress_brotli(contents, level):
+    import brotli
+    return brotli.compress(contents, quality=11)
+
+
+def compress_zstd(contents, level):
+    import zstandard
+    return zstandard.ZstdCompressor(level=19).compress(contents)
+
+
+# Encodings: suffix of compressed file and compression function
+ENCODINGS = {
+    'gzip': ('.gz', compress_gzip),
+    'deflate': ('.zz', compress_deflate),
+    'br': ('.br', compress_brotli),
+    'zstd': ('.zst', compress_zstd),
+}
+
+
+class PrecompressProcessor(Processor):
+    match = r'\.(htm|html|js|css|txt|eot|ttf|svg)$'
     priority = 1000
+    cacheable = True
+    idempotent = True
+    in_memory = True
 
-    compresslevel = 5
+    # Encodings are skipped when their module is not installed
+    encodings = ('gzip', 'br', 'zstd')
+    compresslevel = 9
+    # Smaller files are not compressed
+    min_size = 1024
+    # Compressed files bigger than this ratio of original size are not kept
+    max_ratio = 0.9
+
+    def process_contents(self, contents):
+        if len(contents) < self.min_size:
+            return contents
 
-    def process(self):
-        outfile = '{0}.gz'.format(self.path)
+        for encoding in self.encodings:
+            if encoding not in ENCODINGS:
+                raise ProcessorError('Unknown encoding: {0}'.format(encoding))
 
-        with self.storage.open(self.path, 'rb') as f_in:
+            suffix, compress = ENCODINGS[encoding]
             try:
-                f_out = GzipFile(
-                    self.storage.path(outfile), 'wb',
-                    compresslevel=self.compresslevel
-                )
-            except Exception as e:
-                raise ProcessorError(str(e))
+                data = compress(contents, self.compresslevel)
+            except ImportError:
+                continue
+
+            if self.max_ratio is None or len(data) <= len(contents) * self.max_ratio:
+                self.outputs[suffix] = data
+
+        return contents
 
-            [f_out.write(chunk) for chunk in f_in.chunks()]
-            f_out.close()
+    def save_outputs(self, outputs):
+        new_path = super(PrecompressProcessor, self).save_outputs(outputs)
 
-        return outfile
+        # Copies not created this time (file too small or not compressible enough) are stale
+        created = set([suffix for suffix, contents in outputs])
+        for encoding in self.encodings:
+            suffix = ENCODINGS[encoding][0]
+            name = self.path + suffix
+            if suffix not in created and self.storage.exists(name):
+                self.storage.delete(name)
+
+        return new_path
+
+
+class GZipProcessor(PrecompressProcessor):
+    encodings = ('gzip',)
+    compresslevel = 5
+    min_size = 0
+    max_ratio = None
@@ -9,6 +9,8 @@ from facets.processors.base import CommandProcessor
 
 class OptiPngProcessor(CommandProcessor):
     match = r'\.png$'
+    cacheable = True
+    idempotent = True
 
     program = '/usr/bin/env optipng'
     command = '{program} -o7 -nc {infile}'
@@ -19,6 +21,8 @@ class OptiPngProcessor(CommandProcessor):
 
 class AdvPngProcessor(CommandProcessor):
     match = r'\.png$'
+    cacheable = True
+    idempotent = True
 
     program = '/usr/bin/env advpng'
     command = '{program} -z -4 {infile}'
@@ -29,29 +33,38 @@ class AdvPngProcessor(CommandProcessor):
 
 class JpegtranProcessor(CommandProcessor):
     match = r'\.jpe?g$'
+    cacheable = True
+    idempotent = True
+    in_memory = True
 
     program = '/usr/bin/env jpegtran'
-    command = '{program} -copy none -optimize {infile}'
+    command = '{program} -copy none -optimize'
 
-    def process(self):
-        self.execute_cmd(infile=self.storage.path(self.path))
+    def process_contents(self, contents):
+        return self.execute_contents(contents)
 
 
 class JpegoptimProcessor(CommandProcessor):
     match = r'\.jpe?g$'
+    cacheable = True
+    idempotent = True
+    in_memory = True
 
     program = '/usr/bin/env jpegoptim'
-    command = '{program} -q --strip-all {infile}'
+    command = '{program} -q --strip-all --stdin --stdout'
 
-    def process(self):
-        self.execute_cmd(infile=self.storage.path(self.path))
+    def process_contents(self, contents):
+        return self.execute_contents(contents)
 
 
 class GifsicleProcessor(CommandProcessor):
     match = r'\.gif$'
+    cacheable = True
+    idempotent = True
+    in_memory = True
 
     program = '/usr/bin/env gifsicle'
-    command = '{program} --batch -O3 {infile}'
+    command = '{program} -O3'
 
-    def process(self):
-        self.execute_cmd(infile=self.storage.path(self.path))
+    def process_contents(self, contents):
+        return self.execute_contents(contents)
@@ -4,43 +4,53 @@
 # See the LICENSE for more information.
 from __future__ import (print_function, division, absolute_import, unicode_literals)
 
+from django.utils.encoding import force_str
+
 from facets.processors.base import CommandProcessor, Processor, ProcessorError
 from facets.processors.css import YuiCssProcessor
 
 
 class JsMinProcessor(Processor):
     match = r'\.js$'
+    cacheable = True
+    idempotent = True
+    in_memory = True
 
-    def process(self):
+    def process_contents(self, contents):
         try:
             from jsmin import jsmin
         except ImportError:
             raise ProcessorError('Unable to import jsmin module.')
 
-        self.save_contents(jsmin(self.read()))
+        return jsmin(force_str(contents))
 
 
 class UglifyJsProcessor(CommandProcessor):
     match = r'\.js$'
+    cacheable = True
+    idempotent = True
+    in_memory = True
 
     program = '/usr/bin/env uglifyjs'
-    command = '{program} {infile} --ascii -m -c -o {outfile}'
+    command = '{program} --ascii -m -c'
 
-    def process(self):
-        full_path = self.storage.path(self.path)
-        self.execute_cmd(infile=full_path, outfile=full_path)
+    def process_contents(self, contents):
+        return self.execute_contents(contents)
 
 
 class YuiJsProcessor(YuiCssProcessor):
     match = r'\.js$'
+    file_type = 'js'
 
 
 class GoogleClosureProcessor(CommandProcessor):
     match = r'\.js$'
+    cacheable = True
+    idempotent = True
+    in_memory = True
 
     program = '/usr/bin/env java -jar /path/to/compiler.jar'
-    command = '{program} {infile}'
+    command = '{program}'
 
-    def process(self):
-        contents = self.execute_cmd(infile=self.storage.path(self.path))
-        self.save_contents(contents)
+    def process_contents(self, contents):
+        return self.execute_contents(contents)
@@ -5,44 +5,227 @@
 from __future__ import (print_function, division, absolute_import, unicode_literals)
 
 import hashlib
-import os.path
+import os
+import posixpath
 import sys
+import time
+from tempfile import mkstemp, SpooledTemporaryFile
 from urlparse import urldefrag, urljoin
 
 from django.contrib.staticfiles.storage import StaticFilesStorage
-from django.core.files.base import ContentFile
+from django.core.files.base import ContentFile, File
 from django.test.utils import override_settings
-from django.utils.encoding import force_str, smart_str, filepath_to_uri
+from django.utils.encoding import force_bytes, force_str, smart_str, filepath_to_uri
 
-from facets.cache import cache
+from facets.cache import DiskCache
 from facets.collections import MediaCollectionList, parse_templates
+from facets.compilers.base import get_compiler_cache
 from facets.conf import settings
+from facets.graph import DependencyGraph, get_components, sort_levels
 from facets.handlers import default_handlers
-from facets.processors.base import ProcessorError
-from facets.utils import CommandError, CssDependencies
+from facets.index import HashIndex, file_stat
+from facets.manifest import Manifest
+from facets.processors.base import ProcessorError, save_file
+from facets.utils import (CommandError, CssDependencies, CssUrlsIndex, _umask, command_stats,
+                          parallel_map)
+
+
+class TemporaryCopy(object):
+    """
+    A temporary copy of a file, hashed while being written. On local storages the copy is made
+    in the destination directory and atomically renamed to its final name. Other storages get a
+    spooled temporary file, kept in memory up to ``max_size`` bytes.
+    """
+    max_size = 1024 * 1024
+
+    def __init__(self, storage, path):
+        self.storage = storage
+        self.md5 = hashlib.md5()
+
+        try:
+            directory = os.path.dirname(storage.path(path))
+        except NotImplementedError:
+            self.filename = None
+            self.fp = SpooledTemporaryFile(max_size=self.max_size)
+        else:
+            if not os.path.isdir(directory):
+                try:
+                    os.makedirs(directory)
+                except OSError:
+                    if not os.path.isdir(directory):
+                        raise
+
+            fd, self.filename = mkstemp(prefix='.facets-', suffix='.tmp', dir=directory)
+            self.fp = os.fdopen(fd, 'wb')
+
+    @property
+    def hexdigest(self):
+        return self.md5.hexdigest()
+
+    def write(self, chunk):
+        self.md5.update(chunk)
+        self.fp.write(chunk)
+
+    def save(self, name):
+        if self.filename is None:
+            self.fp.seek(0)
+            self.storage.exists(name) and self.storage.delete(name)
+            self.storage.save(name, File(self.fp))
+            self.fp.close()
+            return
+
+        self.fp.close()
+        permissions = settings.FILE_UPLOAD_PERMISSIONS
+        os.chmod(self.filename, permissions if permissions is not None else 0o666 & ~_umask)
+        os.rename(self.filename, self.storage.path(name))
+        self.filename = None
+
+    def discard(self):
+        self.fp.close()
+        if self.filename is not None:
+            os.unlink(self.filename)
+            self.filename = None
 
 
 class FacetsFilesMixin(object):
+    # Maximum number of memoized URLs
+    url_memo_size = 10000
+
     def __init__(self, *args, **kwargs):
         super(FacetsFilesMixin, self).__init__(*args, **kwargs)
-        self._file_cache = None
+        self._manifest = None
+        self._manifest_checked = 0
+        self._hash_index = None
+        self._url_memo = {}
+        self.css_urls = CssUrlsIndex()
+
+        # Names of stored files and old files to delete, during post_process only
+        self._listing = None
+        self._old_files = None
 
     @property
-    def file_cache(self):
-        if self._file_cache is None:
-            self._file_cache = cache.get('facets:files', {})
+    def manifest(self):
+        # Loaded on first use, then again when its stamp changes. Stamp is checked at most
+        # once every FACETS_MANIFEST_CHECK_INTERVAL seconds.
+        interval = settings.FACETS_MANIFEST_CHECK_INTERVAL
+        if self._manifest is None:
+            self.load_manifest()
+        elif interval is not None and time.time() >= self._manifest_checked + interval:
+            self._manifest_checked = time.time()
+            if Manifest.get_stamp(self) != self._manifest.stamp:
+                self.load_manifest()
+
+        return self._manifest
+
+    @manifest.setter
+    def manifest(self, value):
+        # Manifest is swapped before URL memo, URLs of the old one are never memoized again
+        self._manifest = value
+        self._url_memo = {}
+
+    def load_manifest(self):
+        self._manifest_checked = time.time()
+        self.manifest = Manifest.load(self)
 
-        return self._file_cache
+    @property
+    def file_cache(self):
+        return self.manifest.files
 
     @file_cache.setter
     def file_cache(self, value):
-        self._file_cache = value
-        cache.set('facets:files', value)
+        self.manifest.files = value
+        self._url_memo = {}
+
+    @property
+    def collection_cache(self):
+        return self.manifest.collections
+
+    @collection_cache.setter
+    def collection_cache(self, value):
+        self.manifest.collections = value
+
+    @property
+    def variant_cache(self):
+        return self.manifest.variants
+
+    @variant_cache.setter
+    def variant_cache(self, value):
+        self.manifest.variants = value
+
+    @property
+    def processed_cache(self):
+        return self.manifest.processed
+
+    @processed_cache.setter
+    def processed_cache(self, value):
+        self.manifest.processed = value
+
+    def is_processed(self, hashed_name, processors):
+        """
+        Returns True if idempotent ``processors`` were already applied on ``hashed_name`` and
+        the files they created next to it still exist.
+        """
+        if not processors or not all(p.idempotent for p in processors):
+            return False
+
+        if self.processed_cache.get(hashed_name) != [p.get_signature() for p in processors]:
+            return False
+
+        return all(self.exists(hashed_name + x) for x in self.variant_cache.get(hashed_name, []))
+
+    def get_variants(self, name):
+        """
+        Returns the suffixes of files created next to the stored version of ``name`` by
+        processors (like ``.gz`` or ``.br`` compressed copies).
+        """
+        hashed_name = self.file_cache.get(self.cache_key(name))
+        if hashed_name is None:
+            return []
+
+        return self.variant_cache.get(hashed_name, [])
+
+    def get_collection_html(self, path):
+        """
+        Returns the HTML of a collection as stored by collectstatic, or None if collection is
+        unknown or its stored URL is outdated.
+        """
+        entry = self.collection_cache.get(path)
+        if entry is None or entry['url'] != self.url(path):
+            return None
+
+        return entry['html']
+
+    @property
+    def hash_index(self):
+        if self._hash_index is None:
+            self._hash_index = HashIndex()
+
+        return self._hash_index
 
     def url(self, name, use_cache=True):
         if not settings.FACETS_ENABLED:
             return super(FacetsFilesMixin, self).url(name)
 
+        if not use_cache:
+            return self.get_url(name, False)
+
+        # URLs are memoized until file cache changes, manifest is checked (and reloaded) first
+        self.manifest
+        memo = self._url_memo
+        try:
+            return memo[name]
+        except KeyError:
+            pass
+
+        url = self.get_url(name)
+        if self._url_memo is memo:
+            if len(memo) >= self.url_memo_size:
+                memo.clear()
+            memo[name] = url
+
+        return url
+
+    def get_url(self, name, use_cache=True):
         # Is file compilable? then get generated name
         compiler = default_handlers.get_compiler(None, self, name)
         if compiler:
@@ -67,65 +250,346 @@ class FacetsFilesMixin(object):
         else:
             md5.update(content)
 
-        md5sum = md5.hexdigest()[:12]
+        return self.get_hashed_name(path, md5.hexdigest())
 
+    def get_hashed_name(self, path, hexdigest):
         root, ext = os.path.splitext(path)
-        return u"%s-%s%s" % (root, md5sum, ext)
+        return u"%s-%s%s" % (root, hexdigest[:12], ext)
+
+    def get_file_digest(self, hexdigest, links=None):
+        """
+        Returns the digest of a file from the MD5 hash of its contents and the hashed names of
+        the files it links to. Thus, a CSS file name changes when a linked file changes.
+        """
+        if not links:
+            return hexdigest
+
+        md5 = hashlib.md5(force_bytes(hexdigest))
+        for name in links:
+            md5.update(b'\n' + force_bytes(name))
+
+        return md5.hexdigest()
+
+    def get_source_md5(self, storage, path):
+        """
+        Returns the MD5 hash of a source file, from hash index when the file did not change.
+        """
+        filename = self.source_filename(storage, path)
+        entry = filename and self.hash_index.get_entry(filename)
+        if entry:
+            return entry['md5']
+
+        stat = filename and file_stat(filename)
+        md5 = hashlib.md5()
+        with storage.open(path) as fp:
+            for chunk in fp.chunks():
+                md5.update(chunk)
+
+        if filename:
+            self.hash_index.set_entry(filename, md5.hexdigest(), stat)
+
+        return md5.hexdigest()
+
+    def get_cycle_digest(self, cycle, sources, links):
+        """
+        Returns a digest shared by the files of a dependency ``cycle``, from their contents and
+        ``links`` (the hashed names of files they link to, out of the cycle). ``sources`` are the
+        (storage, path) of files by key.
+        """
+        md5 = hashlib.md5()
+        for key_name in cycle:
+            storage, path = sources[key_name]
+            md5.update(force_bytes(key_name) + b'\n')
+            md5.update(force_bytes(self.get_source_md5(storage, path)) + b'\n')
+            for name in links[key_name]:
+                md5.update(force_bytes(name) + b'\n')
+
+        return md5.hexdigest()
+
+    def source_filename(self, storage, path):
+        """
+        Returns the local filename of a source file or None if storage is not local.
+        """
+        try:
+            return storage.path(path)
+        except NotImplementedError:
+            return None
 
     def get_linked_files(self, paths):
         """
-        Returns a dictionnary of paths linked in CSS.
+        Returns a dictionnary of paths linked in each CSS file.
         """
         files = dict([(k, v) for k, v in paths.items() if os.path.splitext(k)[1] == '.css'])
 
         result = {}
-        n = CssDependencies()
         for prefixed_path, (storage, path) in files.items():
-            key_name = self.cache_key(path)
-            with storage.open(path, 'rb') as fp:
-                n.normalize(force_str(fp.read()), os.path.dirname(path), key_name)
-                result = n.dependencies
+            result[self.cache_key(path)] = self.get_links(storage, path)
 
         return result
 
-    def copy_file(self, storage, path, force=False):
-        with storage.open(path) as original_file:
-            # Compute key and hash
-            key_name = self.cache_key(path)
-            hashed_name = self.hashed_name(force_str(path), original_file)
+    def get_links(self, storage, path):
+        """
+        Returns the list of static files linked in a CSS file. Links are kept in hash index and
+        file is not read again while it does not change.
+        """
+        filename = self.source_filename(storage, path)
+        entry = filename and self.hash_index.get_entry(filename)
+        if entry and 'links' in entry:
+            return entry['links']
+
+        stat = filename and file_stat(filename)
+        with storage.open(path, 'rb') as fp:
+            content = fp.read()
 
-            if hasattr(original_file, 'seek'):
-                original_file.seek(0)
+        md5 = hashlib.md5(content).hexdigest()
+        content = force_str(content)
+        urls = self.css_urls.get(content)
+        links = sorted(CssDependencies().get_links(content, os.path.dirname(path), urls))
 
-            processed = False
-            if force or not self.exists(hashed_name):
-                # Copy file
-                processed = True
-                self.exists(hashed_name) and self.delete(hashed_name)
-                self.save(hashed_name, original_file)
+        if filename:
+            self.hash_index.set_entry(filename, md5, stat, links=links)
 
-            # Check for an old hashed_name to remove
-            if key_name in self.file_cache and self.file_cache[key_name] != hashed_name:
-                self.exists(self.file_cache[key_name]) and self.delete(self.file_cache[key_name])
+        return links
 
-            return key_name, hashed_name, processed
+    def list_files(self, path=''):
+        """
+        Returns the set of names of every file in storage, under ``path``. Storages able to list
+        all their files at once should override it.
+        """
+        try:
+            directories, files = self.listdir(path)
+        except (IOError, OSError):
+            return set()
 
-    def apply_processors(self, media_store, key_name):
-        success_msg = "Applied processor '{0}' on '{1}'\n"
+        result = set([posixpath.join(path, x) for x in files])
+        for directory in directories:
+            result.update(self.list_files(posixpath.join(path, directory)))
+
+        return result
+
+    def add_to_listing(self, name):
+        """
+        Adds a file written without ``save()`` to the listing made by post_process.
+        """
+        self._listing is not None and self._listing.add(name)
+
+    def exists(self, name):
+        # During post_process, files are looked up in a listing made once
+        if self._listing is not None:
+            return name in self._listing
+
+        return super(FacetsFilesMixin, self).exists(name)
+
+    def _save(self, name, content):
+        name = super(FacetsFilesMixin, self)._save(name, content)
+        self.add_to_listing(name)
+        return name
+
+    def delete(self, name):
+        super(FacetsFilesMixin, self).delete(name)
+        self._listing is not None and self._listing.discard(name)
+
+    def delete_files(self, names):
+        """
+        Deletes files of ``names``. Storages able to delete several files at once should
+        override it.
+        """
+        for name in names:
+            self.delete(name)
+
+    def delete_old_file(self, key_name, hashed_name):
+        """
+        Deletes previous hashed file of ``key_name`` if it changed. During post_process, old
+        files are deleted at the end, once the new manifest is saved.
+        """
+        old_name = self.file_cache.get(key_name)
+        if old_name is None or old_name == hashed_name or not self.exists(old_name):
+            return
+
+        if self._old_files is not None:
+            self._old_files.append(old_name)
+        else:
+            self.delete(old_name)
+
+    def copy_file(self, storage, path, force=False, links=None):
+        """
+        Copies a file to its hashed name. ``links`` is the list of hashed names of files linked
+        in this file, they are part of its hash.
+        """
+        key_name = self.cache_key(path)
+        filename = self.source_filename(storage, path)
+
+        # Unchanged files are not read again when their hashed copy exists
+        entry = filename and self.hash_index.get_entry(filename)
+        if entry and not force:
+            digest = self.get_file_digest(entry['md5'], links)
+            hashed_name = self.get_hashed_name(force_str(path), digest)
+            if self.exists(hashed_name):
+                self.delete_old_file(key_name, hashed_name)
+                return key_name, hashed_name, False
+
+        stat = filename and file_stat(filename)
+
+        # Original file is read only once, hashed while being copied to a temporary file
+        copy = TemporaryCopy(self, path)
+        try:
+            with storage.open(path) as original_file:
+                for chunk in original_file.chunks():
+                    copy.write(chunk)
+        except Exception:
+            copy.discard()
+            raise
+
+        digest = self.get_file_digest(copy.hexdigest, links)
+        hashed_name = self.get_hashed_name(force_str(path), digest)
+
+        processed = False
+        exists = self.exists(hashed_name)
+        if exists and force:
+            # A hashed file already processed is kept as is, processors would give the same
+            processors = default_handlers.get_processors(self.file_cache, self, hashed_name)
+            force = not self.is_processed(hashed_name, processors)
+
+        if force or not exists:
+            # Move copy to its final name
+            processed = True
+            copy.save(hashed_name)
+            self.add_to_listing(hashed_name)
+            self.processed_cache.pop(hashed_name, None)
+        else:
+            copy.discard()
+
+        if filename:
+            self.hash_index.set_entry(filename, copy.hexdigest, stat)
+
+        self.delete_old_file(key_name, hashed_name)
+
+        return key_name, hashed_name, processed
+
+    @property
+    def processor_cache(self):
+        if not settings.FACETS_PROCESSOR_CACHE:
+            return None
+
+        return DiskCache(settings.FACETS_PROCESSOR_CACHE, settings.FACETS_PROCESSOR_CACHE_SIZE)
+
+    def run_processors(self, media_store, key_name, processor_cache=None):
+        """
+        Applies processors on a file, in priority order. Returns a list of (is_error, message).
+
+        Following in memory processors pass contents to each other, the file is read before
+        the first one and written after the last one only.
+        """
+        success_msg = "Applied processor '{0}' on '{1}'{2}\n"
         error_msg = 'ERROR: Unable to execute processor {0} on {1}. Error was: {2}\n'
 
-        for processor in default_handlers.get_processors(media_store, self, media_store[key_name]):
+        path = media_store[key_name]
+        contents = None  # Contents of file, when in memory
+        changed = False
+
+        processors = default_handlers.get_processors(media_store, self, path)
+        if self.is_processed(path, processors):
+            return []
+
+        messages = []
+        suffixes = []
+        for processor in processors:
+            suffixes.append(processor.suffixes)
             try:
-                new_path = processor.process()
-                sys.stdout.write(success_msg.format(processor, new_path or processor.path))
+                if processor.in_memory:
+                    if contents is None:
+                        contents = processor.read_bytes()
+
+                    result, new_path, cached = processor.run_contents(contents, processor_cache)
+                    changed = changed or result != contents
+                    contents = result
+                else:
+                    if changed:
+                        save_file(self, path, contents)
+                        changed = False
+                    contents = None
+
+                    new_path, cached = processor.run(processor_cache)
+
+                messages.append((False, success_msg.format(
+                    processor, new_path or processor.path, cached and ' (cached)' or ''
+                )))
             except (CommandError, ProcessorError) as error:
-                sys.stderr.write(error_msg.format(processor, processor.path, str(error)))
+                messages.append((True, error_msg.format(processor, processor.path, str(error))))
+
+        if changed:
+            save_file(self, path, contents)
+
+        # Record files created next to this one
+        suffixes = sorted(set(sum(suffixes, [])))
+        if suffixes:
+            self.variant_cache[path] = suffixes
+        else:
+            self.variant_cache.pop(path, None)
+
+        # Record idempotent processors applied without errors, they are not applied again
+        errors = any(is_error for is_error, message in messages)
+        if processors and not errors and all(p.idempotent for p in processors):
+            self.processed_cache[path] = [p.get_signature() for p in processors]
+        else:
+            self.processed_cache.pop(path, None)
+
+        return messages
+
+    def apply_processors(self, media_store, keys):
+        """
+        Applies processors on files of ``keys``. Files are processed by a pool of workers and
+        messages are written file by file.
+        """
+        processor_cache = self.processor_cache
+
+        def _run_processors(key_name):
+            return self.run_processors(media_store, key_name, processor_cache)
+
+        for messages in parallel_map(_run_processors, keys, settings.FACETS_WORKERS):
+            for is_error, message in messages:
+                (sys.stderr if is_error else sys.stdout).write(message)
+
+    def store_collection(self, collection_store, collection):
+        """
+        Stores final HTML of a collection, so it can be rendered without parsing its content.
+        """
+        url = self.get_url(collection.path)
+        collection_store[collection.path] = {
+            'url': url,
+            'html': collection.get_html(url),
+        }
 
     def post_process(self, paths, dry_run=False, **options):
         # Dry-run, stop it now
         if dry_run:
             return
 
+        # Existence checks are answered from a single listing and old files deleted at once,
+        # remote storages are not requested for each file
+        self._listing = self.list_files()
+        self._old_files = []
+        try:
+            for result in self.process_files(paths):
+                yield result
+
+            hashed_names = set(self.file_cache.values())
+            self.delete_files(sorted(set([x for x in self._old_files if x not in hashed_names])))
+        finally:
+            self._listing = None
+            self._old_files = None
+
+    def process_files(self, paths):
+        """
+        Compiles, copies and processes files of ``paths``, then saves the manifest. Yields
+        ``(original name, processed name, processed)`` tuples.
+        """
+        graph = DependencyGraph()
+        command_stats.reset()
+
+        # Manifest is updated on a copy, it may be read only (when it comes from facets cache)
+        self.manifest = self.manifest.copy()
+
         #
         # Compile files
         #
@@ -136,7 +600,8 @@ class FacetsFilesMixin(object):
                 continue
 
             if compiler.should_compile():
-                compiler.compile()
+                compiler.run()
+                self.add_to_listing(compiler.new_name)
                 yield path, compiler.new_name, True
 
             # Add this new file to paths
@@ -157,59 +622,68 @@ class FacetsFilesMixin(object):
         # Post process
         #
         media_store = self.file_cache
+        self._url_memo = {}
+        self.css_urls = CssUrlsIndex()
         processed_list = {}
 
         # First, create dependencies tree on CSS files
-        dependencies = self.get_linked_files(paths)
-
-        # Iterate on files and process them if not already cached
-        for prefixed_path in sorted(paths.keys()):
-            storage, path = paths[prefixed_path]
-            key_name, hashed_name, processed = self.copy_file(storage, path)
-            media_store[key_name] = hashed_name
-
-            if processed:
-                processed_list[key_name] = hashed_name
-
-            yield path, hashed_name, processed
-
-        # Iterate on processed files in case we need to update linked files
-        keys = processed_list.keys()
-        for key_name in keys:
-            if key_name not in dependencies:
-                # File has no dependencies
-                continue
-
-            for _name in dependencies[key_name]:
-                if _name in keys:
-                    # Dependency has already been processed
-                    continue
-
-                # Dependency forced update
-                storage, path = paths[_name]
-                key_name, hashed_name, processed = self.copy_file(storage, path, True)
+        css_links = self.get_linked_files(paths)
+
+        # Iterate on files and process them if not already cached. CSS files are hashed after
+        # the files they link to. Files of a same level are hashed and copied by a pool of
+        # workers but results come back in order.
+        sources = dict([(self.cache_key(v[1]), v) for v in paths.values()])
+
+        def _copy_file(args):
+            key_name, links = args
+            storage, path = sources[key_name]
+            return (path,) + self.copy_file(storage, path, links=links)
+
+        # Files of a dependency cycle can not include hashed names of each other in their
+        # hash, they share a digest of the whole cycle instead
+        cycles = {}
+        for component in get_components(sources.keys(), css_links):
+            if len(component) > 1:
+                cycles.update([(x, tuple(component)) for x in component])
+
+        def _get_links(key_name):
+            cycle = cycles.get(key_name, ())
+            return [media_store[x] for x in css_links.get(key_name, [])
+                    if x in sources and x not in cycle]
+
+        for level in sort_levels(sources.keys(), css_links):
+            links = dict([(x, _get_links(x)) for x in level])
+            for cycle in set([cycles[x] for x in level if x in cycles]):
+                digest = self.get_cycle_digest(cycle, sources, links)
+                for key_name in cycle:
+                    links[key_name] = links[key_name] + [digest]
+
+            level = [(x, links[x]) for x in level]
+            copied = parallel_map(_copy_file, level, settings.FACETS_WORKERS)
+            for path, key_name, hashed_name, processed in copied:
                 media_store[key_name] = hashed_name
 
                 if processed:
                     processed_list[key_name] = hashed_name
 
-                yield _name, hashed_name, processed
+                yield path, hashed_name, processed
 
-        # Get collection list (to be processed later)
+        # Get collection list (to be processed later). Only changed templates are parsed.
         with override_settings(FACETS_ENABLED=False):
             collection_list = MediaCollectionList()
-            for _collections in parse_templates():
+            for _collections in parse_templates(graph['templates']):
                 if isinstance(_collections, Exception):
                     raise _collections
                 else:
                     collection_list.update(_collections)
 
         # Apply processors on processed files
-        for key_name in processed_list.keys():
-            self.apply_processors(media_store, key_name)
+        self.apply_processors(media_store, sorted(processed_list.keys()))
 
-        for collection in collection_list:
-            if collection.path in [x[1] for x in paths.values()]:
+        collection_store = {}
+        graph['collections'] = {}
+        for collection in sorted(collection_list, key=lambda x: x.path):
+            if collection.path in sources:
                 raise ValueError('(Collection) File {0} already exists.'.format(collection.path))
 
             # Get original media keys
@@ -224,8 +698,10 @@ class FacetsFilesMixin(object):
 
                 media_keys.append(name)
 
+            graph['collections'][collection.path] = media_keys
+
             # Is there processed files in collection?
-            has_changes = len(set(processed_list.keys()) & set(media_keys)) > 0
+            has_changes = collection.path in graph.get_collections(processed_list.keys())
 
             key_name = self.cache_key(collection.path)
             hashed_name = self.file_cache.get(key_name)
@@ -236,11 +712,12 @@ class FacetsFilesMixin(object):
 
             if not has_changes and file_exists:
                 media_store[key_name] = hashed_name
+                self.store_collection(collection_store, collection)
                 continue
 
             # Fix collection media list (get compiled named)
             collection.media = [self.url(x, False) for x in media_keys]
-            contents = ContentFile(smart_str(collection.get_data()))
+            contents = ContentFile(smart_str(collection.get_data(self.css_urls)))
 
             # Create "unprocessed" collection file
             self.exists(collection.path) and self.delete(collection.path)
@@ -248,15 +725,46 @@ class FacetsFilesMixin(object):
             sys.stdout.write("Wrote collection '{0}'\n".format(collection.path))
 
             # Process file and apply handlers
-            key_name, hashed_name, processed = self.copy_file(self, collection.path, True)
+            links = None
+            if os.path.splitext(collection.path)[1] == '.css':
+                links = [media_store[x] for x in self.get_links(self, collection.path)
+                         if x in media_store]
+
+            key_name, hashed_name, processed = self.copy_file(self, collection.path, True, links)
 
             media_store[key_name] = hashed_name
             yield key_name, hashed_name, processed
 
-            self.apply_processors(media_store, key_name)
+            self.apply_processors(media_store, [key_name])
+            self.store_collection(collection_store, collection)
 
-        # Save file cache
+        # Save manifest
         self.file_cache = media_store
+        self.collection_cache = collection_store
+
+        hashed_names = set(media_store.values())
+        self.variant_cache = dict(
+            (k, v) for k, v in self.variant_cache.items() if k in hashed_names
+        )
+        self.processed_cache = dict(
+            (k, v) for k, v in self.processed_cache.items() if k in hashed_names
+        )
+        self.manifest.save(self)
+
+        self.hash_index.prune()
+        self.hash_index.save()
+        graph.save()
+
+        for disk_cache in (self.processor_cache, get_compiler_cache()):
+            if disk_cache is not None:
+                disk_cache.cull()
+
+        # Commands report
+        report = command_stats.report()
+        if report:
+            sys.stdout.write('Commands:\n')
+            for line in report:
+                sys.stdout.write('  {0}\n'.format(line))
 
 
 class FacetsFilesStorage(FacetsFilesMixin, StaticFilesStorage):
@@ -5,6 +5,7 @@
 from __future__ import (print_function, division, absolute_import, unicode_literals)
 
 from django import template
+from django.contrib.staticfiles.storage import staticfiles_storage
 
 from facets.collections import MediaCollection
 from facets.conf import settings
@@ -18,11 +19,16 @@ class MediaCollectionNode(template.Node):
         self.path = path
 
     def render(self, context):
-        output = self.nodelist.render(context)
-
         if not settings.FACETS_ENABLED:
-            return output
+            return self.nodelist.render(context)
 
+        # HTML stored by collectstatic
+        get_collection_html = getattr(staticfiles_storage, 'get_collection_html', None)
+        html = get_collection_html and get_collection_html(self.path)
+        if html is not None:
+            return html
+
+        output = self.nodelist.render(context)
         collection = MediaCollection(output, self.path)
         return collection.get_html()
 
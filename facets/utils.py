@@ -4,20 +4,109 @@
 # See the LICENSE for more information.
 from __future__ import (print_function, division, absolute_import, unicode_literals)
 
+from contextlib import contextmanager
+import errno
+import hashlib
+from multiprocessing.pool import ThreadPool
+import os
 import re
 import shlex
 from subprocess import Popen, PIPE
+from tempfile import gettempdir, mkstemp
+import threading
+import time
 
 from django.utils.encoding import smart_str, force_bytes
 from django.utils.six.moves.urllib.parse import urljoin, urlsplit, urlunsplit
 
 from facets.conf import settings
+from facets.workers import CLOSE_FDS, WorkerError, get_pool
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+
+# Current umask, used to give temporary copies the permissions of a regular file
+_umask = os.umask(0)
+os.umask(_umask)
+
+# Semaphores limiting running commands, by FACETS_MAX_PROCESSES value
+_semaphores = {}
+
+# Thread locks of file_lock(), by name
+_locks = {}
+_locks_lock = threading.Lock()
 
 
 class CommandError(Exception):
     pass
 
 
+def atomic_write(filename, data, mode=None):
+    """
+    Writes ``data`` to a temporary file next to ``filename`` and renames it. Temporary file is
+    given ``mode`` permissions when set.
+    """
+    directory = os.path.dirname(filename)
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+
+    fd, tmp_name = mkstemp(prefix='.facets-', suffix='.tmp', dir=directory)
+    try:
+        with os.fdopen(fd, 'wb') as fp:
+            fp.write(force_bytes(data))
+        mode is not None and os.chmod(tmp_name, mode)
+        os.rename(tmp_name, filename)
+    except Exception:
+        os.path.exists(tmp_name) and os.unlink(tmp_name)
+        raise
+
+
+@contextmanager
+def file_lock(name):
+    """
+    Holds an exclusive lock on ``name`` (usually a filename) against other threads and, through
+    a lock file in the temporary directory when ``fcntl`` is available, other processes.
+    """
+    with _locks_lock:
+        lock = _locks.setdefault(name, threading.Lock())
+
+    with lock:
+        if fcntl is None:
+            yield
+            return
+
+        filename = os.path.join(gettempdir(), 'facets-{0}.lock'.format(
+            hashlib.md5(force_bytes(name)).hexdigest()
+        ))
+        with open(filename, 'a') as fp:
+            fcntl.flock(fp.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(fp.fileno(), fcntl.LOCK_UN)
+
+
+def parallel_map(func, iterable, workers=1):
+    """
+    Applies ``func`` on every item of ``iterable`` using a pool of ``workers`` threads and
+    yields results in the order of ``iterable``. Runs serially when ``workers`` is 1.
+    """
+    if not workers or workers <= 1:
+        for item in iterable:
+            yield func(item)
+        return
+
+    pool = ThreadPool(workers)
+    try:
+        for result in pool.imap(func, iterable):
+            yield result
+    finally:
+        pool.terminate()
+
+
 class UrlsNormalizer(object):
     patterns = (
         (re.compile(r"""(url\(['"]{0,1}\s*(?P<url>.*?)["']{0,1}\))"""), """url("{new}")"""),
@@ -27,8 +116,28 @@ class UrlsNormalizer(object):
     def __init__(self, root_url=None):
         self.root_url = root_url or settings.STATIC_URL
 
-    def get_replace_args(self, parts, match):
-        parts = self.rebuild_url_parts(match.group('url'), parts, self.get_new_path(parts))
+    def scan(self, content):
+        """
+        Returns a list of (start, end, url, replacement) for every URL found in ``content``,
+        ordered by offset.
+        """
+        matches = []
+        for pattern, repl in self.patterns:
+            for m in pattern.finditer(content):
+                matches.append((m.start(1), m.end(1), m.group('url'), repl))
+
+        # Patterns should not overlap but keep only the first match if they do
+        result = []
+        offset = 0
+        for match in sorted(matches):
+            if match[0] >= offset:
+                result.append(match)
+                offset = match[1]
+
+        return result
+
+    def get_replace_args(self, parts, url):
+        parts = self.rebuild_url_parts(url, parts, self.get_new_path(parts))
 
         return {
             'new': urlunsplit(parts)
@@ -65,55 +174,197 @@ class UrlsNormalizer(object):
     def get_new_path(self, parts):
         return urljoin(self.base_src, parts.path)
 
-    def replace(self, match, repl):
-        groups = match.groups()
-        parts = urlsplit(match.group('url'))
+    def set_location(self, location):
+        self.base_src = urljoin(self.root_url, location)
+        if not self.base_src.endswith('/'):
+            self.base_src += '/'
+
+    def replace(self, original, url, repl):
+        parts = urlsplit(url)
 
         if not self.check_parts(parts):
-            return groups[0]
+            return original
 
-        kwargs = self.get_replace_args(parts, match)
+        kwargs = self.get_replace_args(parts, url)
 
         return repl.format(**kwargs)
 
-    def normalize(self, content, location):
-        self.base_src = urljoin(self.root_url, location)
-        if not self.base_src.endswith('/'):
-            self.base_src += '/'
+    def normalize(self, content, location, urls=None):
+        """
+        Rewrites URLs of ``content``. ``urls`` is the result of ``scan()`` on ``content`` and is
+        computed when not provided.
+        """
+        self.set_location(location)
+        if urls is None:
+            urls = self.scan(content)
 
-        for pattern, repl in self.patterns:
-            rep_func = lambda m: self.replace(m, repl)
-            content = pattern.sub(rep_func, content)
+        result = []
+        offset = 0
+        for start, end, url, repl in urls:
+            result.append(content[offset:start])
+            result.append(self.replace(content[start:end], url, repl))
+            offset = end
 
-        return content
+        result.append(content[offset:])
+        return ''.join(result)
 
 
 class CssDependencies(UrlsNormalizer):
-    def __init__(self, root_url=None):
-        super(CssDependencies, self).__init__(root_url)
-        self.dependencies = {}
-
-    def get_new_path(self, parts):
-        path = super(CssDependencies, self).get_new_path(parts)
-        if path.startswith(self.root_url):
-            key = path[len(self.root_url):]
-            if key not in self.dependencies:
-                self.dependencies[key] = set([self.key_name])
-            else:
-                self.dependencies[key].add(self.key_name)
-
-        return path
-
-    def normalize(self, content, location, key_name):
-        self.key_name = key_name
-        return super(CssDependencies, self).normalize(content, location)
+    def get_links(self, content, location, urls=None):
+        """
+        Returns the set of static files linked in ``content``.
+        """
+        self.set_location(location)
+        if urls is None:
+            urls = self.scan(content)
+
+        links = set()
+        for start, end, url, repl in urls:
+            parts = urlsplit(url)
+            if not self.check_parts(parts):
+                continue
+
+            path = self.get_new_path(parts)
+            if path.startswith(self.root_url):
+                links.add(path[len(self.root_url):])
+
+        return links
+
+
+class CssUrlsIndex(object):
+    """
+    URLs found in CSS contents, indexed by the MD5 hash of contents, so that each CSS content is
+    scanned only once.
+    """
+    def __init__(self):
+        self.urls = {}
+
+    def get(self, content):
+        key = hashlib.md5(force_bytes(content)).hexdigest()
+        if key not in self.urls:
+            self.urls[key] = UrlsNormalizer().scan(content)
+
+        return self.urls[key]
+
+
+class MeasuredPopen(Popen):
+    """
+    A Popen recording resource usage of the process when waiting for it. Signals are not sent
+    once the process is reaped, its pid could belong to another process.
+    """
+    rusage = None
+
+    def __init__(self, *args, **kwargs):
+        self.lock = threading.RLock()
+        super(MeasuredPopen, self).__init__(*args, **kwargs)
+
+    def reap(self):
+        """
+        Reaps the process if it exited, without waiting. Process is reaped and its return code
+        set at once under the lock of ``send_signal()``. Returns the return code or None.
+        """
+        with self.lock:
+            if self.returncode is not None or not hasattr(os, 'wait4'):
+                return self.returncode
+
+            try:
+                pid, status, rusage = os.wait4(self.pid, os.WNOHANG)
+            except OSError as e:
+                if e.errno != errno.EINTR:
+                    raise
+                return None
+
+            if pid:
+                self.rusage = rusage
+                if os.WIFSIGNALED(status):
+                    self.returncode = -os.WTERMSIG(status)
+                else:
+                    self.returncode = os.WEXITSTATUS(status)
+
+            return self.returncode
+
+    def poll(self):
+        if not hasattr(os, 'wait4'):
+            return super(MeasuredPopen, self).poll()
+        return self.reap()
+
+    def wait(self, *args, **kwargs):
+        # Polled, a blocking wait could not hold the lock
+        delay = 0.0005
+        while hasattr(os, 'wait4') and self.reap() is None:
+            time.sleep(delay)
+            delay = min(delay * 2, 0.05)
+
+        return super(MeasuredPopen, self).wait(*args, **kwargs)
+
+    def send_signal(self, sig):
+        with self.lock:
+            if self.returncode is None:
+                super(MeasuredPopen, self).send_signal(sig)
+
+
+class CommandStats(object):
+    """
+    Runs, total wall and CPU times and peak memory (RSS) of commands, by handler. Totals are
+    kept rather than every command, they do not grow with the number of commands run.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.handlers = {}
+
+    def add(self, handler, wall, rusage=None):
+        cpu, maxrss = 0, 0
+        if rusage is not None:
+            cpu = rusage.ru_utime + rusage.ru_stime
+            maxrss = rusage.ru_maxrss * 1024  # Kilobytes
+
+        with self.lock:
+            runs, wall_total, cpu_total, peak = self.handlers.get(handler, (0, 0, 0, 0))
+            self.handlers[handler] = (runs + 1, wall_total + wall, cpu_total + cpu,
+                                      max(peak, maxrss))
+
+    def report(self):
+        """
+        Returns report lines: runs, total wall and CPU times and peak RSS of each handler.
+        """
+        with self.lock:
+            handlers = dict(self.handlers)
+
+        return ['{0}: {1} run(s), wall {2:.2f}s, cpu {3:.2f}s, peak rss {4:.1f}MB'.format(
+            handler, runs, wall, cpu, peak / (1024 * 1024)
+        ) for handler, (runs, wall, cpu, peak) in sorted(handlers.items())]
+
+
+command_stats = CommandStats()
+
+
+def get_semaphore():
+    """
+    Returns the semaphore limiting running commands to ``FACETS_MAX_PROCESSES``, or None.
+    """
+    value = settings.FACETS_MAX_PROCESSES
+    if not value:
+        return None
+
+    with _locks_lock:
+        return _semaphores.setdefault(value, threading.BoundedSemaphore(value))
 
 
 class CommandHandlerMixin(object):
     command = None
     program = None
+    # Command starting a resident worker process, see facets.workers.Worker
+    worker = None
+    # Number of seconds after which a command is killed, FACETS_COMMAND_TIMEOUT when None
+    timeout = None
 
     def execute_cmd(self, infile=None, outfile=None, data=None, **kwargs):
+        if self.worker:
+            return self.execute_worker(infile=infile, outfile=outfile, data=data, **kwargs)
+
         if not self.program:
             raise CommandError('No program provided')
 
@@ -122,14 +373,69 @@ class CommandHandlerMixin(object):
 
         cmd = self.command.format(program=self.program, infile=infile, outfile=outfile, **kwargs)
 
+        semaphore = get_semaphore()
+        semaphore and semaphore.acquire()
         try:
-            cmd = shlex.split(smart_str(cmd))
-            p = Popen(cmd, stdin=PIPE, stdout=PIPE, stderr=PIPE)
+            return self.run_cmd(shlex.split(smart_str(cmd)), data)
+        finally:
+            semaphore and semaphore.release()
+
+    def run_cmd(self, cmd, data=None):
+        timeout = self.timeout if self.timeout is not None else settings.FACETS_COMMAND_TIMEOUT
+        start = time.time()
+
+        try:
+            p = MeasuredPopen(cmd, stdin=PIPE, stdout=PIPE, stderr=PIPE, close_fds=CLOSE_FDS)
         except OSError as e:
             raise CommandError('OSError on command: {0}'.format(str(e)))
-        else:
+
+        timer = None
+        if timeout:
+            timer = threading.Timer(timeout, self.kill_cmd, [p])
+            timer.start()
+
+        try:
             out, err = p.communicate(force_bytes(data))
-            if p.returncode != 0:
-                raise CommandError('Command error: {0}'.format(err))
+        finally:
+            timer and timer.cancel()
+            command_stats.add(self.__class__.__name__, time.time() - start, p.rusage)
+
+        if p.returncode != 0 and getattr(p, 'timed_out', False):
+            raise CommandError('Command timed out after {0} seconds: {1}'.format(
+                timeout, ' '.join(cmd)
+            ))
+        if p.returncode != 0:
+            raise CommandError('Command error: {0}'.format(err))
+
+        return out
+
+    def kill_cmd(self, p):
+        try:
+            p.timed_out = True
+            p.kill()  # Does nothing once process is reaped
+        except OSError:
+            pass  # Already done
 
-            return out
+    def execute_worker(self, infile=None, outfile=None, data=None, **kwargs):
+        if not self.command:
+            raise CommandError('No command provided')
+
+        args = self.command.format(program='', infile=infile, outfile=outfile, **kwargs)
+        timeout = self.timeout if self.timeout is not None else settings.FACETS_COMMAND_TIMEOUT
+
+        semaphore = get_semaphore()
+        semaphore and semaphore.acquire()
+        start = time.time()
+        try:
+            header, out = get_pool(self.worker).request(shlex.split(smart_str(args)), data,
+                                                        timeout)
+        except WorkerError as e:
+            raise CommandError(str(e))
+        finally:
+            command_stats.add(self.__class__.__name__, time.time() - start)
+            semaphore and semaphore.release()
+
+        if header.get('status') != 0:
+            raise CommandError('Command error: {0}'.format(header.get('error', '')))
+
+        return out
@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of Django facets released under the MIT license.
+# See the LICENSE for more information.
+from __future__ import (print_function, division, absolute_import, unicode_literals)
+
+import os.path
+import sys
+import threading
+
+from django.contrib.staticfiles.storage import StaticFilesStorage
+
+from facets.compilers.base import CompilerError
+from facets.conf import settings
+from facets.finders import get_base_finders, get_base_finders_locations
+from facets.handlers import default_handlers
+from facets.utils import CommandError
+
+
+class PollingObserver(object):
+    """
+    Finds changed files by comparing modification times of every file in ``locations``.
+    """
+    def __init__(self, locations, interval):
+        self.locations = locations
+        self.interval = interval
+        self.mtimes = self.get_mtimes()
+        self.event = threading.Event()
+
+    def get_mtimes(self):
+        result = {}
+        for location in self.locations:
+            for directory, _ds, files in os.walk(location):
+                for filename in files:
+                    filename = os.path.join(directory, filename)
+                    try:
+                        result[filename] = os.path.getmtime(filename)
+                    except OSError:
+                        continue
+
+        return result
+
+    def wait(self):
+        """
+        Waits for changes and returns the set of changed (or created, or removed) filenames.
+        """
+        self.event.wait(self.interval)
+
+        mtimes = self.get_mtimes()
+        changed = set([k for k, v in mtimes.items() if self.mtimes.get(k) != v])
+        changed.update(set(self.mtimes) - set(mtimes))
+        self.mtimes = mtimes
+
+        return changed
+
+
+class InotifyObserver(object):
+    """
+    Finds changed files with inotify (requires pyinotify).
+    """
+    def __init__(self, locations, interval):
+        import pyinotify
+
+        mask = (pyinotify.IN_CLOSE_WRITE | pyinotify.IN_MOVED_TO | pyinotify.IN_CREATE |
+                pyinotify.IN_DELETE | pyinotify.IN_MOVED_FROM)
+
+        self.interval = interval
+        self.changed = set()
+        self.manager = pyinotify.WatchManager()
+        self.notifier = pyinotify.Notifier(self.manager, self.process_event)
+        for location in locations:
+            self.manager.add_watch(location, mask, rec=True, auto_add=True)
+
+    def process_event(self, event):
+        self.changed.add(event.pathname)
+
+    def wait(self):
+        if self.notifier.check_events(int(self.interval * 1000)):
+            self.notifier.read_events()
+            self.notifier.process_events()
+
+        changed, self.changed = self.changed, set()
+        return changed
+
+
+def get_observer(locations, interval):
+    try:
+        return InotifyObserver(locations, interval)
+    except ImportError:
+        return PollingObserver(locations, interval)
+
+
+class Watcher(threading.Thread):
+    """
+    Compiles files, in a background thread, as soon as they or one of the files they import
+    change.
+    """
+    def __init__(self, interval=None):
+        super(Watcher, self).__init__()
+        self.daemon = True
+        self.interval = interval or settings.FACETS_WATCH_INTERVAL
+        self.storage = StaticFilesStorage()
+        self.stopped = False
+
+    def get_compilers(self):
+        """
+        Returns the list of compilers of all compilable files.
+        """
+        result = []
+        for finder in get_base_finders():
+            for path, storage in finder.list(['CVS', '.*', '*~']):
+                try:
+                    original = storage.path(path)
+                except NotImplementedError:
+                    continue
+
+                compiler = default_handlers.get_compiler(original, self.storage, path)
+                if compiler is not None:
+                    result.append(compiler)
+
+        return result
+
+    def build_graph(self):
+        """
+        Builds the list of compilers to run for each original or imported filename.
+        """
+        self.compilers = self.get_compilers()
+        self.graph = {}
+        # Compilers of files with unknown imports
+        self.unknown = []
+        for compiler in self.compilers:
+            dependencies, complete = compiler.find_dependencies()
+            complete or self.unknown.append(compiler)
+            for filename in [compiler.original] + dependencies:
+                self.graph.setdefault(filename, []).append(compiler)
+
+    def compile(self, compiler):
+        try:
+            with compiler.lock():
+                compiler.run()
+        except (CommandError, CompilerError) as e:
+            sys.stderr.write("ERROR: Unable to compile '{0}'. Error was: {1}\n".format(
+                compiler.path, e
+            ))
+        else:
+            sys.stdout.write("Compiled '{0}'\n".format(compiler.path))
+
+    def run(self):
+        observer = get_observer(list(get_base_finders_locations()), self.interval)
+        self.build_graph()
+
+        for compiler in self.compilers:
+            if compiler.check_modified():
+                self.compile(compiler)
+
+        while not self.stopped:
+            changed = observer.wait()
+            changed and self.process_changes(changed)
+
+    def process_changes(self, changed):
+        """
+        Runs compilers of files depending on ``changed`` filenames.
+        """
+        # New or removed files may change imports
+        if changed - set(self.graph):
+            self.build_graph()
+
+        compilers = {}
+        for filename in changed:
+            for compiler in self.graph.get(filename, []):
+                compilers[compiler.path] = compiler
+
+        # Compilers without known imports depend on any file with a checked extension
+        for compiler in self.unknown:
+            if any(
+                x.endswith(compiler.check_extensions) for x in changed
+            ):
+                compilers[compiler.path] = compiler
+
+        for path in sorted(compilers):
+            self.compile(compilers[path])
+
+        # Imports of compiled files may have changed
+        compilers and self.build_graph()
+
+    def stop(self):
+        self.stopped = True
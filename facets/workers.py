@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of Django facets released under the MIT license.
+# See the LICENSE for more information.
+from __future__ import (print_function, division, absolute_import, unicode_literals)
+
+import atexit
+import json
+import os
+import shlex
+import struct
+from subprocess import Popen, PIPE
+import threading
+
+from django.utils.encoding import force_bytes, smart_str
+from django.utils.six.moves.queue import Queue
+
+from facets.conf import settings
+
+# Processes started from several threads must not inherit the pipes of each other, they would
+# never get the end of their input (not supported on Windows)
+CLOSE_FDS = os.name == 'posix'
+
+
+class WorkerError(Exception):
+    """
+    Raised when a worker process dies or breaks the protocol.
+    """
+    pass
+
+
+def write_frame(fp, data):
+    fp.write(struct.pack(b'>I', len(data)))
+    fp.write(data)
+
+
+def read_frame(fp):
+    size = fp.read(4)
+    if len(size) != 4:
+        raise WorkerError('Worker closed its output')
+
+    size = struct.unpack(b'>I', size)[0]
+    data = fp.read(size)
+    if len(data) != size:
+        raise WorkerError('Worker closed its output')
+
+    return data
+
+
+class Worker(object):
+    """
+    A resident process handling requests one after another, see "Worker processes" in README.
+    """
+    timed_out = False
+
+    def __init__(self, command):
+        try:
+            self.process = Popen(shlex.split(smart_str(command)), stdin=PIPE, stdout=PIPE,
+                                 close_fds=CLOSE_FDS)
+        except OSError as e:
+            raise WorkerError('OSError on worker: {0}'.format(str(e)))
+
+    def request(self, args, data=None, timeout=None):
+        """
+        Sends a request and returns ``(header, data)`` of the response. The process is killed
+        when there is no response after ``timeout`` seconds.
+        """
+        timer = None
+        if timeout:
+            timer = threading.Timer(timeout, self.kill)
+            timer.start()
+
+        try:
+            try:
+                write_frame(self.process.stdin, force_bytes(json.dumps({'args': args})))
+                write_frame(self.process.stdin, force_bytes(data or b''))
+                self.process.stdin.flush()
+
+                header = json.loads(read_frame(self.process.stdout).decode('utf-8'))
+                return header, read_frame(self.process.stdout)
+            except (IOError, ValueError) as e:
+                raise WorkerError('Worker error: {0}'.format(str(e)))
+        except WorkerError:
+            if self.timed_out:
+                raise WorkerError('Worker timed out after {0} seconds'.format(timeout))
+            raise
+        finally:
+            timer and timer.cancel()
+
+    def kill(self):
+        self.timed_out = True
+        try:
+            self.process.kill()
+        except OSError:
+            pass  # Already done
+
+    def close(self):
+        if self.process.poll() is None:
+            self.process.stdin.close()
+            self.process.wait()
+
+
+class WorkerPool(object):
+    """
+    Up to ``size`` workers started with ``command``. Each worker handles one request at a time.
+    """
+    def __init__(self, command, size):
+        self.command = command
+        self.size = size
+        self.started = 0
+        self.idle = Queue()
+        self.lock = threading.Lock()
+        self.workers = []
+
+    def acquire(self):
+        with self.lock:
+            if self.idle.empty() and self.started < self.size:
+                self.started += 1
+                self.idle.put(None)  # Started on first use
+
+        worker = self.idle.get()
+        if worker is None:
+            try:
+                worker = self.start()
+            except WorkerError:
+                self.idle.put(None)
+                raise
+
+        return worker
+
+    def start(self):
+        worker = Worker(self.command)
+        with self.lock:
+            self.workers.append(worker)
+
+        return worker
+
+    def discard(self, worker):
+        with self.lock:
+            self.workers.remove(worker)
+        worker.process.poll() is None and worker.process.kill()
+        worker.process.wait()
+
+    def request(self, args, data=None, timeout=None):
+        """
+        Sends a request to an idle worker. A dead worker is replaced and the request sent again
+        once, unless it was killed after ``timeout`` seconds.
+        """
+        worker = self.acquire()
+        try:
+            result = worker.request(args, data, timeout)
+        except WorkerError:
+            self.discard(worker)
+            if worker.timed_out:
+                self.idle.put(None)
+                raise
+
+            worker = None
+            try:
+                worker = self.start()
+                result = worker.request(args, data, timeout)
+            except WorkerError:
+                worker is not None and self.discard(worker)
+                self.idle.put(None)
+                raise
+
+        self.idle.put(worker)
+        return result
+
+    def close(self):
+        with self.lock:
+            workers, self.workers = self.workers, []
+
+        for worker in workers:
+            worker.close()
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(command):
+    """
+    Returns the shared pool of workers started with ``command``.
+    """
+    with _pools_lock:
+        if command not in _pools:
+            size = settings.FACETS_WORKER_POOL_SIZE or settings.FACETS_WORKERS
+            _pools[command] = WorkerPool(command, size)
+
+        return _pools[command]
+
+
+@atexit.register
+def close_pools():
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+
+    for pool in pools:
+        pool.close()
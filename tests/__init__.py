@@ -35,6 +35,7 @@ def setup_test_environment():
             },
         },
         'INSTALLED_APPS': [
+            'django.contrib.staticfiles',
             'facets',
             'appA',
             'appB',
@@ -51,6 +52,7 @@ def setup_test_environment():
             'django.contrib.staticfiles.finders.AppDirectoriesFinder',
         ),
         'STATICFILES_DIRS': (os.path.join(ROOT, 'tests/static'),),
+        'TEMPLATE_DIRS': (os.path.join(ROOT, 'tests/templates'),),
         'STATIC_URL': '/static/',
         'STATIC_ROOT': mkdtemp()
     }
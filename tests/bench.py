@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of Django facets released under the MIT license.
+# See the LICENSE for more information.
+"""
+Micro benchmarks. Run them with ``python -m tests.bench [name ...]``.
+"""
+from __future__ import (print_function, division, absolute_import, unicode_literals)
+
+from array import array
+from shutil import rmtree
+import sys
+import timeit
+
+from tests import setup_test_environment
+
+BENCHMARKS = []
+
+
+def benchmark(func):
+    BENCHMARKS.append(func)
+    return func
+
+
+def report(label, func, number, calls=1, repeat=3):
+    """
+    Prints the best time of ``func`` which makes ``calls`` calls of the measured function.
+    """
+    duration = min(timeit.repeat(func, number=number, repeat=repeat))
+    print('  {0:<40} {1:>10.2f} us/call'.format(label, duration / number / calls * 1e6))
+
+
+@benchmark
+def url():
+    """
+    Cost of FacetsFilesStorage.url() with and without URL memoization.
+    """
+    from django.test.utils import override_settings
+    from facets.storages import FacetsFilesStorage
+
+    with override_settings(FACETS_ENABLED=True, FACETS_HANDLERS=(
+            'facets.compilers.css.LessCompiler', 'facets.processors.css.CssUrlsProcessor')):
+        storage = FacetsFilesStorage()
+        storage.file_cache = dict(
+            ('css/file-{0}.css'.format(i), 'css/file-{0}-0123456789ab.css'.format(i))
+            for i in range(1000)
+        )
+        names = ['css/file-{0}.css'.format(i) for i in range(0, 1000, 10)]
+
+        report('url() without memo', lambda: [storage.get_url(x) for x in names], 100, len(names))
+        report('url() with memo', lambda: [storage.url(x) for x in names], 100, len(names))
+
+
+@benchmark
+def css():
+    """
+    URL rewriting and minification of a 2MB stylesheet: regular expressions plus cssmin against
+    the single pass facets.css.optimize().
+    """
+    from facets.css import optimize
+    from facets.processors.css import UrlsReplacer
+
+    block = """/* Block {0} */
+.block-{0} .title, .block-{0} > h2 {{
+    background: url(../img/title-{0}.png) no-repeat 0 0;
+    font: bold 12px/1.5 "Helvetica Neue", sans-serif ;
+}}
+
+@media screen and (max-width: 600px) {{
+    .block-{0}:hover {{ background-image: url("../img/hover-{0}.png?#iefix"); }}
+}}
+"""
+    content = ''.join(block.format(i) for i in range(7000))
+    media_store = dict(('img/title-{0}.png'.format(i), 'img/title-{0}-0123456789ab.png'.format(i))
+                       for i in range(7000))
+
+    def regex():
+        return UrlsReplacer(media_store).normalize(content, 'css')
+
+    report('regex URLs', regex, 3)
+    try:
+        from cssmin import cssmin
+    except ImportError:
+        print('  cssmin is not installed')
+    else:
+        # cssmin time grows faster than size, this takes minutes
+        report('regex URLs + cssmin', lambda: cssmin(regex()), 1, repeat=1)
+    report('optimize() URLs', lambda: optimize(content, 'css', UrlsReplacer(media_store),
+                                               minify=False), 3)
+    report('optimize()', lambda: optimize(content, 'css', UrlsReplacer(media_store)), 3)
+
+
+def sizeof(obj, seen=None):
+    """
+    Returns the size in bytes of ``obj`` and the objects it holds.
+    """
+    seen = seen if seen is not None else set()
+    if id(obj) in seen:
+        return 0
+
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum([sizeof(k, seen) + sizeof(v, seen) for k, v in obj.items()])
+    elif isinstance(obj, (list, tuple, set)):
+        size += sum([sizeof(x, seen) for x in obj])
+    elif hasattr(obj, '__dict__') and not isinstance(obj, array):
+        size += sizeof(obj.__dict__, seen)
+
+    return size
+
+
+@benchmark
+def manifest():
+    """
+    Memory used by 100000 hashed names, in a dictionary and in facets.manifest.CompactFiles, and
+    cost of a lookup.
+    """
+    from facets.manifest import CompactFiles
+
+    files = dict(
+        ('app{0}/img/icons/file-{1}.png'.format(i % 50, i),
+         'app{0}/img/icons/file-{1}-{2:012x}.png'.format(i % 50, i, i * 7919))
+        for i in range(100000)
+    )
+    compact = CompactFiles(files)
+    names = ['app{0}/img/icons/file-{1}.png'.format(i % 50, i) for i in range(0, 100000, 1000)]
+
+    for label, value in (('dict', files), ('CompactFiles', compact)):
+        print('  {0:<40} {1:>10.2f} bytes/entry'.format(label, sizeof(value) / len(files)))
+        report('{0} lookup'.format(label), lambda: [value[x] for x in names], 100, len(names))
+
+
+def main(names):
+    setup_test_environment()
+    from django.conf import settings
+
+    try:
+        for func in BENCHMARKS:
+            if names and func.__name__ not in names:
+                continue
+
+            print('{0}: {1}'.format(func.__name__, func.__doc__.strip()))
+            func()
+    finally:
+        rmtree(settings.STATIC_ROOT)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
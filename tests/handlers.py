@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of Django facets released under the MIT license.
+# See the LICENSE for more information.
+from __future__ import (print_function, division, absolute_import, unicode_literals)
+
+import time
+
+from facets.compilers.base import Compiler
+from facets.compilers.css import LessCompiler
+from facets.processors.base import Processor
+
+
+class UpperLessCompiler(Compiler):
+    """
+    A Less "compiler" turning contents upper case, counting compilations.
+    """
+    extensions = LessCompiler.extensions
+    check_extensions = LessCompiler.check_extensions
+    new_name = LessCompiler.new_name
+    import_pattern = LessCompiler.import_pattern
+    import_extensions = LessCompiler.import_extensions
+
+    count = 0
+    delay = 0
+
+    def compile(self):
+        UpperLessCompiler.count += 1
+        time.sleep(self.delay)
+        with open(self.original, 'r') as fp:
+            self.save_contents(fp.read().upper())
+
+        return self.new_name
+
+
+class UpperCssProcessor(Processor):
+    """
+    An in memory processor turning CSS contents upper case.
+    """
+    match = r'\.css$'
+    in_memory = True
+
+    def process_contents(self, contents):
+        return contents.upper()
@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of Django facets released under the MIT license.
+# See the LICENSE for more information.
+from __future__ import (print_function, division, absolute_import, unicode_literals)
+
+from collections import defaultdict
+
+from django.contrib.staticfiles.storage import StaticFilesStorage
+
+from facets.storages import FacetsFilesMixin
+
+
+class CountingFileSystemStorage(StaticFilesStorage):
+    """
+    A local storage counting requests, standing for a remote storage.
+    """
+    calls = defaultdict(int)
+
+    def exists(self, name):
+        self.calls['exists'] += 1
+        return super(CountingFileSystemStorage, self).exists(name)
+
+    def listdir(self, path):
+        self.calls['listdir'] += 1
+        return super(CountingFileSystemStorage, self).listdir(path)
+
+    def delete(self, name):
+        self.calls['delete'] += 1
+        return super(CountingFileSystemStorage, self).delete(name)
+
+
+class CountingStorage(FacetsFilesMixin, CountingFileSystemStorage):
+    pass
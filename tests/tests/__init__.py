@@ -4,4 +4,9 @@
 # See the LICENSE for more information.
 from __future__ import (print_function, division, absolute_import, unicode_literals)
 
+from .test_collections import *
 from .test_compiler import *
+from .test_css import *
+from .test_storage import *
+from .test_utils import *
+from .test_watcher import *
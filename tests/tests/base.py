@@ -8,6 +8,11 @@ import os
 from shutil import rmtree
 
 from django.conf import settings
+from django.contrib.staticfiles import finders
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.core.management import call_command
+from django.test.utils import override_settings
+from django.utils.functional import empty
 import django.test
 
 
@@ -20,4 +25,42 @@ class TestCase(django.test.TestCase):
     def tearDown(self):
         # Empty STATIC_ROOT
         for path in os.listdir(settings.STATIC_ROOT):
-            rmtree(os.path.join(settings.STATIC_ROOT, path))
+            path = os.path.join(settings.STATIC_ROOT, path)
+            if os.path.isdir(path):
+                rmtree(path)
+            else:
+                os.unlink(path)
+
+
+@override_settings(
+    FACETS_ENABLED=True,
+    STATICFILES_STORAGE='facets.storages.FacetsFilesStorage',
+    FACETS_HANDLERS=('facets.processors.css.CssUrlsProcessor',)
+)
+class StorageTestCase(TestCase):
+    def setUp(self):
+        super(StorageTestCase, self).setUp()
+
+        from facets.cache import cache
+        cache.clear()
+        staticfiles_storage._wrapped = empty
+
+    def get_paths(self):
+        paths = {}
+        for finder in finders.get_finders():
+            for path, storage in finder.list(['CVS', '.*', '*~']):
+                if getattr(storage, 'prefix', None):
+                    prefixed_path = os.path.join(storage.prefix, path)
+                else:
+                    prefixed_path = path
+
+                paths.setdefault(prefixed_path, (storage, path))
+
+        return paths
+
+    def collectstatic(self):
+        """
+        Copies static files and returns the list of post processed files.
+        """
+        call_command('collectstatic', interactive=False, verbosity=0, post_process=False)
+        return list(staticfiles_storage.post_process(self.get_paths()))
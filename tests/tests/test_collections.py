@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of Django facets released under the MIT license.
+# See the LICENSE for more information.
+from __future__ import (print_function, division, absolute_import, unicode_literals)
+
+import os
+from shutil import rmtree
+from tempfile import mkdtemp
+
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.template.loader import render_to_string
+from django.utils.functional import empty
+
+from facets import collections
+from facets.graph import DependencyGraph
+from facets.templatetags import facets
+
+from .base import StorageTestCase
+
+
+class CollectionTestCase(StorageTestCase):
+    def test_collection(self):
+        self.collectstatic()
+        storage = staticfiles_storage
+
+        hashed_name = storage.file_cache['css/all.css']
+        self.assertTrue(storage.exists(hashed_name))
+
+        with storage.open(hashed_name) as fp:
+            contents = fp.read().decode('utf-8')
+            self.assertIn(storage.file_cache['img/logo.png'], contents)
+
+        self.assertIn('/static/{0}'.format(hashed_name), render_to_string('collections.html'))
+
+    def test_precompiled(self):
+        self.collectstatic()
+        expected = render_to_string('collections.html')
+
+        class Collection(object):
+            def __init__(self, *args, **kwargs):
+                raise AssertionError('Collection should not be parsed.')
+
+        original, facets.MediaCollection = facets.MediaCollection, Collection
+        try:
+            self.assertEqual(render_to_string('collections.html'), expected)
+
+            # Outdated entries are not used
+            staticfiles_storage.collection_cache['css/all.css']['url'] = '/static/css/all.css'
+            self.assertRaises(AssertionError, render_to_string, 'collections.html')
+        finally:
+            facets.MediaCollection = original
+
+    def test_incremental(self):
+        self.collectstatic()
+
+        graph = DependencyGraph()
+        self.assertEqual(graph['collections']['css/all.css'], ['css/screen.css', 'css/print.css'])
+        self.assertEqual(graph.get_collections(['img/logo.png']), set())
+
+        # Unchanged templates are not parsed again
+        def parse_template(tmpl_path):
+            raise AssertionError('Template should not be parsed.')
+
+        original, collections.parse_template = collections.parse_template, parse_template
+        try:
+            staticfiles_storage._wrapped = empty
+            self.collectstatic()
+        finally:
+            collections.parse_template = original
+
+        self.assertIn('css/all.css', staticfiles_storage.collection_cache)
+
+    def test_include(self):
+        def write(name, contents):
+            with open(os.path.join(directory, name), 'w') as fp:
+                fp.write(contents)
+
+        def get_paths():
+            return set([
+                x.path for result in collections.parse_templates(template_cache) for x in result
+            ])
+
+        collection = (
+            '{{% load facets %}}{{% mediacollection "{0}" %}}'
+            '<link rel="stylesheet" href="/static/css/print.css" />{{% endmediacollection %}}'
+        )
+
+        directory = mkdtemp()
+        template_cache = {}
+        try:
+            write('base.html', '{% include "part.html" %}')
+            write('part.html', collection.format('css/part.css'))
+            with self.settings(TEMPLATE_DIRS=(directory,)):
+                self.assertEqual(get_paths(), set(['css/part.css']))
+
+                # Included template changes, not the including one
+                write('part.html', collection.format('css/other-part.css'))
+                self.assertEqual(get_paths(), set(['css/other-part.css']))
+        finally:
+            rmtree(directory)
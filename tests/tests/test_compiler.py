@@ -4,12 +4,23 @@
 # See the LICENSE for more information.
 from __future__ import (print_function, division, absolute_import, unicode_literals)
 
+import os
 import re
+from shutil import rmtree
+from tempfile import mkdtemp
+import threading
+import time
 
 from django.conf import settings
+from django.contrib.staticfiles.storage import staticfiles_storage
 from django.test.utils import override_settings
 from django.utils.encoding import smart_str
 
+from facets.compilers.css import LessCompiler, SasscCompiler
+from facets.finders import FacetsFinder, find_in_base_finders
+from tests import ROOT
+from tests.handlers import UpperLessCompiler
+
 from .base import TestCase
 
 RE_SPACES = re.compile(r'\s', re.S)
@@ -93,3 +104,189 @@ class StylusTestCase(TestCase):
             drop_spaces(r.content),
             'body{background:#fff;color:#008000;padding:2px;}'
         )
+
+
+@override_settings(FACETS_ENABLED=False, FACETS_HANDLERS=('tests.handlers.UpperLessCompiler',))
+class CompilerCacheTestCase(TestCase):
+    def setUp(self):
+        super(CompilerCacheTestCase, self).setUp()
+        self.cache_dir = mkdtemp()
+
+    def tearDown(self):
+        rmtree(self.cache_dir)
+        super(CompilerCacheTestCase, self).tearDown()
+
+    def test_dependencies(self):
+        from facets.handlers import default_handlers
+
+        original = find_in_base_finders('less/deps.less')
+        compiler = default_handlers.get_compiler(original, staticfiles_storage, 'less/deps.less')
+        self.assertEqual(
+            [os.path.relpath(x, ROOT) for x in compiler.get_dependencies()],
+            sorted([
+                'tests/appA/static/less/include-2.less',
+                'tests/appB/static/less/include-1.less',
+                'tests/appB/static/less/include-2.less',
+                'tests/static/less/included.less',
+            ])
+        )
+
+    def test_cache(self):
+        with self.settings(FACETS_COMPILER_CACHE=self.cache_dir):
+            UpperLessCompiler.count = 0
+            r = self.client.get('/static/less/deps.less')
+            self.assertEqual(UpperLessCompiler.count, 1)
+            content = r.content
+
+            # Compiled file is restored from cache
+            super(CompilerCacheTestCase, self).tearDown()
+            r = self.client.get('/static/less/deps.less')
+            self.assertEqual(UpperLessCompiler.count, 1)
+            self.assertEqual(r.content, content)
+
+    @override_settings(FACETS_COMPILE_CHECK_TTL=0)
+    def test_should_compile(self):
+        from facets.handlers import default_handlers
+
+        self.client.get('/static/less/deps.less')
+        original = find_in_base_finders('less/deps.less')
+        compiler = default_handlers.get_compiler(original, staticfiles_storage, 'less/deps.less')
+        self.assertFalse(compiler.should_compile())
+
+        # Only imported files are checked
+        filename = os.path.join(ROOT, 'tests/static/less/included.less')
+        st = os.stat(filename)
+        os.utime(filename, (st.st_atime, st.st_mtime + 3600 * 24 * 365 * 100))
+        try:
+            self.assertTrue(compiler.should_compile())
+        finally:
+            os.utime(filename, (st.st_atime, st.st_mtime))
+
+    def test_unknown_imports(self):
+        from facets.handlers import default_handlers
+
+        with self.settings(FACETS_COMPILER_CACHE=self.cache_dir, FACETS_HANDLERS=(
+                ('tests.handlers.UpperLessCompiler', {'import_pattern': None}),)):
+            default_handlers._setup()
+            UpperLessCompiler.count = 0
+            self.client.get('/static/less/deps.less')
+
+            # Imports may have changed, file is compiled again
+            super(CompilerCacheTestCase, self).tearDown()
+            self.client.get('/static/less/deps.less')
+            self.assertEqual(UpperLessCompiler.count, 2)
+
+
+class ImportsTestCase(TestCase):
+    def setUp(self):
+        super(ImportsTestCase, self).setUp()
+        self.directory = mkdtemp()
+
+    def tearDown(self):
+        rmtree(self.directory)
+        super(ImportsTestCase, self).tearDown()
+
+    def write(self, files):
+        # Sources are older than files compiled from them
+        for name, contents in files.items():
+            filename = os.path.join(self.directory, name)
+            with open(filename, 'w') as fp:
+                fp.write(contents)
+            os.utime(filename, (0, 0))
+
+    def get_compiler(self, klass, name):
+        return klass(os.path.join(self.directory, name), staticfiles_storage, name)
+
+    def test_sass(self):
+        self.write({
+            'main.scss': '@import "a",\n  "b";\n@import \'c\', d;\nbody { color: red; }\n',
+            '_a.scss': '', '_b.scss': '', 'c.scss': '', '_d.scss': '',
+        })
+        compiler = self.get_compiler(SasscCompiler, 'main.scss')
+        self.assertEqual(
+            [os.path.basename(x) for x in compiler.get_dependencies()],
+            ['_a.scss', '_b.scss', '_d.scss', 'c.scss']
+        )
+
+    def test_less(self):
+        self.write({
+            'main.less': '@import url(a.less);\n@import (reference) "b";\n@import url("c");\n',
+            'a.less': '', 'b.less': '', 'c.less': '',
+        })
+        compiler = self.get_compiler(LessCompiler, 'main.less')
+        self.assertEqual(compiler.find_dependencies(), (
+            [os.path.join(self.directory, x) for x in ('a.less', 'b.less', 'c.less')], True
+        ))
+
+        # A name that can not be resolved to a file
+        self.write({'main.less': '@import "a";\n@import "missing";\n'})
+        self.assertFalse(compiler.find_dependencies()[1])
+
+    def test_check_modified(self):
+        self.write({'main.scss': '@import "a", "b";\n', '_a.scss': '', '_b.scss': ''})
+        compiler = self.get_compiler(SasscCompiler, 'main.scss')
+        compiler.save_contents('body {}')
+        self.assertFalse(compiler.check_modified())
+
+        # Every name of an import list is checked
+        future = time.time() + 3600
+        os.utime(os.path.join(self.directory, '_b.scss'), (future, future))
+        self.assertTrue(compiler.check_modified())
+
+    def test_check_unknown(self):
+        self.write({'main.scss': '@import "a", "missing";\n', '_a.scss': ''})
+        compiler = self.get_compiler(SasscCompiler, 'main.scss')
+        compiler.save_contents('body {}')
+        self.assertFalse(compiler.check_modified())
+
+        # Some imports are unknown, other Sass files are checked
+        filename = os.path.join(ROOT, 'tests/static/sass/included.scss')
+        st = os.stat(filename)
+        os.utime(filename, (st.st_atime, st.st_mtime + 3600 * 24 * 365 * 100))
+        try:
+            self.assertTrue(compiler.check_modified())
+        finally:
+            os.utime(filename, (st.st_atime, st.st_mtime))
+
+
+@override_settings(FACETS_ENABLED=False, FACETS_COMPILE_CHECK_TTL=0, FACETS_HANDLERS=(
+    ('tests.handlers.UpperLessCompiler', {'delay': 0.2}),
+))
+class SingleFlightTestCase(TestCase):
+    def test_find(self):
+        UpperLessCompiler.count = 0
+        results = []
+
+        def find():
+            results.append(FacetsFinder().find('less/basic.less'))
+
+        threads = [threading.Thread(target=find) for _i in range(4)]
+        [x.start() for x in threads]
+        [x.join() for x in threads]
+
+        self.assertEqual(UpperLessCompiler.count, 1)
+        self.assertEqual(len(set(results)), 1)
+        with open(results[0], 'r') as fp:
+            contents = fp.read()
+        self.assertTrue(contents)
+        self.assertEqual(contents, contents.upper())
+
+
+@override_settings(FACETS_ENABLED=False)
+class LessOutputTestCase(TestCase):
+    def compile(self, **options):
+        original = find_in_base_finders('less/basic.less')
+        compiler = LessCompiler(original, staticfiles_storage, 'less/basic.less', **options)
+        compiler.compile()
+
+        with open(original) as fp:
+            contents = fp.read()
+        with staticfiles_storage.open('less/basic.css') as fp:
+            self.assertEqual(fp.read().decode('utf-8'), contents)
+
+    def test_stdout(self):
+        self.compile(program='/usr/bin/env cat', command='{program} {infile}')
+
+    def test_outfile(self):
+        self.compile(program='/usr/bin/env cp', command='{program} {infile} {outfile}')
+        self.assertEqual(os.listdir(os.path.join(settings.STATIC_ROOT, 'less')), ['basic.css'])
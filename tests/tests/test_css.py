@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of Django facets released under the MIT license.
+# See the LICENSE for more information.
+from __future__ import (print_function, division, absolute_import, unicode_literals)
+
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.test.utils import override_settings
+from django.utils import unittest
+
+from facets.css import optimize
+from facets.handlers import default_handlers
+from facets.utils import UrlsNormalizer
+
+from .base import StorageTestCase
+from .test_utils import CSS
+
+
+class OptimizeTestCase(unittest.TestCase):
+    def test_urls(self):
+        self.assertEqual(
+            optimize(CSS, 'css', UrlsNormalizer('/static/'), minify=False),
+            UrlsNormalizer('/static/').normalize(CSS, 'css')
+        )
+
+    def test_minify(self):
+        self.assertEqual(optimize(
+            '/* comment */\n/*! license */\n'
+            'h1 , h2 > a:hover {\n  color: red ;\n  width: calc(100% - 2px);\n}\n'
+            'p::after { content: "a  b" }\n'
+        ), (
+            '/*! license */h1,h2>a:hover{color:red;width:calc(100% - 2px)}'
+            'p::after{content:"a  b"}'
+        ))
+
+    def test_comments(self):
+        self.assertEqual(optimize('a/**/b'), 'a b')
+        self.assertEqual(optimize('p { margin: 1px/* top */2px /**/ 3px }'),
+                         'p{margin:1px 2px 3px}')
+        self.assertEqual(optimize('.a/**/.b, p/**/{ color: red }'), '.a.b,p{color:red}')
+
+    def test_all(self):
+        self.assertEqual(
+            optimize('h1 {\n  background: url( ../img/title.png?#iefix );\n}\n', 'css',
+                     UrlsNormalizer('/static/')),
+            'h1{background:url("/static/img/title.png?#iefix")}'
+        )
+
+
+class CssOptimizeProcessorTestCase(StorageTestCase):
+    def setUp(self):
+        super(CssOptimizeProcessorTestCase, self).setUp()
+        self.settings_override = override_settings(
+            FACETS_HANDLERS=('facets.processors.css.CssOptimizeProcessor',)
+        )
+        self.settings_override.enable()
+        default_handlers._setup()
+
+    def tearDown(self):
+        self.settings_override.disable()
+        super(CssOptimizeProcessorTestCase, self).tearDown()
+
+    def test_process(self):
+        self.collectstatic()
+        storage = staticfiles_storage
+
+        with storage.open(storage.file_cache['css/screen.css']) as fp:
+            contents = fp.read().decode('utf-8')
+
+        self.assertIn(storage.file_cache['img/logo.png'], contents)
+        self.assertNotIn('\n', contents.strip())
@@ -0,0 +1,582 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of Django facets released under the MIT license.
+# See the LICENSE for more information.
+from __future__ import (print_function, division, absolute_import, unicode_literals)
+
+from gzip import GzipFile
+import hashlib
+import os
+from shutil import rmtree
+import stat
+import sys
+from tempfile import mkdtemp
+import zlib
+
+from django.conf import settings
+from django.contrib.staticfiles import finders
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage
+from django.core.management import call_command
+from django.test.utils import override_settings
+from django.utils.functional import empty
+from django.utils.six import StringIO
+
+from facets import manifest, storages
+from facets.cache import DiskCache, cache
+from facets.graph import get_components, sort_levels
+from facets.handlers import default_handlers
+from facets.index import HashIndex
+from facets.manifest import Manifest
+from facets.processors.gz import GZipProcessor, PrecompressProcessor, compress_gzip
+from facets.processors.js import UglifyJsProcessor
+from tests.storages import CountingStorage
+
+from .base import StorageTestCase
+
+
+class PostProcessTestCase(StorageTestCase):
+    def test_basic(self):
+        self.collectstatic()
+        storage = staticfiles_storage
+
+        hashed_name = storage.file_cache['img/logo.png']
+        self.assertTrue(hashed_name.startswith('img/logo-'))
+        self.assertTrue(storage.exists(hashed_name))
+        self.assertEqual(storage.url('img/logo.png'), '/static/{0}'.format(hashed_name))
+
+        with storage.open(storage.file_cache['css/screen.css']) as fp:
+            self.assertIn(hashed_name, fp.read().decode('utf-8'))
+
+    def test_copy(self):
+        self.collectstatic()
+        storage = staticfiles_storage
+
+        for directory, _ds, files in os.walk(settings.STATIC_ROOT):
+            self.assertEqual([x for x in files if x.startswith('.facets-')], [])
+
+        mode = os.stat(storage.path(storage.file_cache['plop.txt'])).st_mode
+        self.assertTrue(mode & stat.S_IRUSR and mode & stat.S_IRGRP)
+
+        with storage.open('plop.txt') as fp:
+            self.assertEqual(storage.hashed_name('plop.txt', fp), storage.file_cache['plop.txt'])
+
+    def test_linked_hash(self):
+        self.collectstatic()
+        storage = staticfiles_storage
+        file_cache = storage.file_cache
+
+        # CSS hashes include the hashed names of linked files
+        with storage.open('css/screen.css') as fp:
+            md5 = hashlib.md5(fp.read()).hexdigest()
+
+        self.assertNotEqual(file_cache['css/screen.css'],
+                            storage.get_hashed_name('css/screen.css', md5))
+        self.assertEqual(file_cache['css/screen.css'], storage.get_hashed_name(
+            'css/screen.css', storage.get_file_digest(md5, [file_cache['img/logo.png']])
+        ))
+
+        self.assertEqual(sort_levels(['img/logo.png', 'css/screen.css', 'css/print.css'], {
+            'css/screen.css': ['img/logo.png'],
+            'css/print.css': ['css/screen.css', 'img/logo.png'],
+        }), [['img/logo.png'], ['css/screen.css'], ['css/print.css']])
+        self.assertEqual(sort_levels(['a', 'b', 'c', 'd'], {'a': ['b'], 'b': ['a'], 'd': ['a']}),
+                         [['a', 'b', 'c'], ['d']])
+        self.assertEqual(get_components(['a', 'b', 'c', 'd'], {
+            'a': ['b'], 'b': ['c', 'a'], 'c': ['d'], 'd': ['c'],
+        }), [['c', 'd'], ['a', 'b']])
+
+    def test_cycle(self):
+        directory = mkdtemp()
+        source = FileSystemStorage(location=directory)
+        storage = staticfiles_storage
+
+        def write(name, contents):
+            source.exists(name) and source.delete(name)
+            source.save(name, ContentFile(contents))
+
+        def collect():
+            call_command('collectstatic', interactive=False, verbosity=0, post_process=False)
+            paths = self.get_paths()
+            for name in ('css/cycle-a.css', 'css/cycle-b.css'):
+                paths[name] = (source, name)
+            list(storage.post_process(paths))
+
+            names = [storage.file_cache['css/cycle-a.css'], storage.file_cache['css/cycle-b.css']]
+            contents = []
+            for name in names:
+                with storage.open(name) as fp:
+                    contents.append(fp.read().decode('utf-8'))
+
+            # Each file links to the current hashed name of the other one
+            self.assertIn(names[1], contents[0])
+            self.assertIn(names[0], contents[1])
+            return names
+
+        try:
+            write('css/cycle-a.css', b'@import url(cycle-b.css);\n.a { color: red; }\n')
+            write('css/cycle-b.css', b'.b { background: url(cycle-a.css); }\n')
+            names = collect()
+
+            # Both hashed names change when one file of the cycle changes
+            write('css/cycle-b.css', b'.b { background: url(cycle-a.css) no-repeat; }\n')
+            new_names = collect()
+            self.assertNotEqual(new_names[0], names[0])
+            self.assertNotEqual(new_names[1], names[1])
+        finally:
+            rmtree(directory)
+
+    def test_url_memo(self):
+        storage = staticfiles_storage
+        storage.file_cache = {'plop.txt': 'plop-123456789012.txt'}
+        self.assertEqual(storage.url('plop.txt'), '/static/plop-123456789012.txt')
+
+        storage.file_cache = {'plop.txt': 'plop-abcdefabcdef.txt'}
+        self.assertEqual(storage.url('plop.txt'), '/static/plop-abcdefabcdef.txt')
+
+        with self.settings(FACETS_ENABLED=False):
+            self.assertEqual(storage.url('plop.txt'), '/static/plop.txt')
+
+    @override_settings(FACETS_WORKERS=4)
+    def test_workers(self):
+        def get_contents():
+            with staticfiles_storage.open(staticfiles_storage.file_cache['css/print.css']) as fp:
+                return fp.read()
+
+        result = self.collectstatic()
+        file_cache = dict(staticfiles_storage.file_cache)
+        contents = get_contents()
+        self.tearDown()
+        self.setUp()
+
+        with self.settings(FACETS_WORKERS=1):
+            self.assertEqual(self.collectstatic(), result)
+            self.assertEqual(staticfiles_storage.file_cache, file_cache)
+            self.assertEqual(get_contents(), contents)
+
+
+class ManifestTestCase(StorageTestCase):
+    def test_file(self):
+        self.collectstatic()
+        file_cache = dict(staticfiles_storage.file_cache)
+        self.assertTrue(os.path.isfile(os.path.join(settings.STATIC_ROOT, 'facets.json')))
+        self.assertEqual(len(manifest.CompactFiles(file_cache).other), 0)
+
+        # Manifest is read from its file by new processes
+        cache.clear()
+        staticfiles_storage._wrapped = empty
+        self.assertIsInstance(staticfiles_storage.file_cache, manifest.CompactFiles)
+        self.assertEqual(staticfiles_storage.file_cache, file_cache)
+        self.assertIn('css/all.css', staticfiles_storage.collection_cache)
+
+    def test_compact(self):
+        files = {
+            'plop.txt': 'plop-0123456789ab.txt',
+            'css/print.css': 'css/print-abcdef012345.css',
+            'css/screen.css': 'css/screen-000000000000.css',
+            'css/fonts/icons.woff': 'css/fonts/icons-111111111111.woff',
+            'img/caf\xe9.png': 'img/caf\xe9-222222222222.png',
+            'LICENSE': 'LICENSE-333333333333',
+            'other.txt': 'other-123.txt',
+        }
+        compact = manifest.CompactFiles(files)
+        self.assertEqual(compact.other, {'other.txt': 'other-123.txt'})
+        self.assertEqual(len(compact), len(files))
+        self.assertEqual(dict(compact), files)
+        for name, hashed_name in files.items():
+            self.assertEqual(compact[name], hashed_name)
+
+        self.assertNotIn('css/main.css', compact)
+        self.assertNotIn('css/print', compact)
+        self.assertNotIn('js/print.css', compact)
+        self.assertEqual(compact.get('zzz.txt'), None)
+
+        # Non ASCII names given as UTF-8 bytes (native strings on Python 2)
+        name = 'img/caf\xe9.png'.encode('utf-8')
+        self.assertEqual(compact[name], 'img/caf\xe9-222222222222.png')
+        self.assertEqual(compact.get('caf\xe9.txt'.encode('utf-8')), None)
+
+    def test_cache(self):
+        with self.settings(FACETS_MANIFEST_CACHE=True):
+            self.collectstatic()
+            file_cache = dict(staticfiles_storage.file_cache)
+
+            # Manifest is read from cache when its file is missing
+            os.unlink(os.path.join(settings.STATIC_ROOT, 'facets.json'))
+            staticfiles_storage._wrapped = empty
+            self.assertEqual(staticfiles_storage.file_cache, file_cache)
+
+        staticfiles_storage._wrapped = empty
+        self.assertEqual(staticfiles_storage.file_cache, {})
+
+    def test_shards(self):
+        with self.settings(FACETS_MANIFEST_CACHE=True, FACETS_MANIFEST_SHARDS=4):
+            self.collectstatic()
+            hashed_name = staticfiles_storage.file_cache['css/screen.css']
+            os.unlink(os.path.join(settings.STATIC_ROOT, 'facets.json'))
+            staticfiles_storage._wrapped = empty
+            manifest.shard_cache.shards.clear()
+
+            # Only the shard holding this name is fetched
+            self.assertEqual(staticfiles_storage.url('css/screen.css'), '/static/' + hashed_name)
+            self.assertEqual(len(manifest.shard_cache.shards), 1)
+
+    def test_missing_shard(self):
+        with self.settings(FACETS_MANIFEST_CACHE=True, FACETS_MANIFEST_SHARDS=4):
+            self.collectstatic()
+            hashed_name = staticfiles_storage.file_cache['css/screen.css']
+            filename = os.path.join(settings.STATIC_ROOT, 'facets.json')
+            with open(filename, 'rb') as fp:
+                data = fp.read()
+            os.unlink(filename)
+            staticfiles_storage._wrapped = empty
+            manifest.shard_cache.shards.clear()
+
+            # Shard evicted from cache, manifest is read from storage instead
+            key = staticfiles_storage.file_cache.get_key('css/screen.css')
+            cache.delete(key)
+            self.assertNotIn('css/screen.css', staticfiles_storage.file_cache)
+            self.assertNotIn(key, manifest.shard_cache.shards)
+
+            with open(filename, 'wb') as fp:
+                fp.write(data)
+            self.assertEqual(staticfiles_storage.file_cache['css/screen.css'], hashed_name)
+
+    def test_shard_cache(self):
+        cache.set_many({'a': {'x': 1}, 'b': {'y': 2}, 'c': {'z': 3}})
+        shard_cache = manifest.ShardCache(2)
+        self.assertEqual(shard_cache.get_many(['a', 'b', 'c']),
+                         {'a': {'x': 1}, 'b': {'y': 2}, 'c': {'z': 3}})
+        self.assertEqual(list(shard_cache.shards), ['b', 'c'])
+
+        shard_cache.get_many(['b'])
+        shard_cache.get_many(['a'])
+        self.assertEqual(list(shard_cache.shards), ['b', 'a'])
+
+        # Misses are not kept
+        self.assertEqual(shard_cache.get_many(['a', 'd']), {'a': {'x': 1}})
+        self.assertEqual(list(shard_cache.shards), ['b', 'a'])
+
+    def test_reload(self):
+        storage = staticfiles_storage
+        with self.settings(FACETS_MANIFEST_CHECK_INTERVAL=0):
+            Manifest({'files': {'plop.txt': 'plop-123456789012.txt'}}).save(storage)
+            self.assertEqual(storage.url('plop.txt'), '/static/plop-123456789012.txt')
+
+            # A new manifest is used without restarting
+            Manifest({'files': {'plop.txt': 'plop-abcdefabcdef.txt'}}).save(storage)
+            self.assertEqual(storage.url('plop.txt'), '/static/plop-abcdefabcdef.txt')
+
+        with self.settings(FACETS_MANIFEST_CHECK_INTERVAL=None):
+            Manifest({'files': {'plop.txt': 'plop-000000000000.txt'}}).save(storage)
+            self.assertEqual(storage.url('plop.txt'), '/static/plop-abcdefabcdef.txt')
+
+
+class ListingTestCase(StorageTestCase):
+    def setUp(self):
+        super(ListingTestCase, self).setUp()
+        self.settings_override = override_settings(
+            STATICFILES_STORAGE='tests.storages.CountingStorage'
+        )
+        self.settings_override.enable()
+
+    def tearDown(self):
+        self.settings_override.disable()
+        staticfiles_storage._wrapped = empty
+        super(ListingTestCase, self).tearDown()
+
+    def test_requests(self):
+        call_command('collectstatic', interactive=False, verbosity=0, post_process=False)
+        directories = sum([len(x[1]) for x in os.walk(settings.STATIC_ROOT)]) + 1
+
+        calls = CountingStorage.calls
+        calls.clear()
+        list(staticfiles_storage.post_process(self.get_paths()))
+
+        # One listing per directory, no existence check
+        self.assertEqual(calls['exists'], 0)
+        self.assertEqual(calls['listdir'], directories)
+
+        # Old files are deleted at the end
+        storage = staticfiles_storage
+        old_name = storage.file_cache['plop.txt']
+        storage.file_cache['plop.txt'] = 'plop-000000000000.txt'
+        storage.save('plop-000000000000.txt', ContentFile(b'plop'))
+
+        calls.clear()
+        list(storage.post_process(self.get_paths()))
+        self.assertEqual(calls['exists'], 0)
+        self.assertEqual(calls['delete'], 1)
+        self.assertFalse(storage.exists('plop-000000000000.txt'))
+        self.assertTrue(storage.exists(old_name))
+
+
+class HashIndexTestCase(StorageTestCase):
+    def setUp(self):
+        super(HashIndexTestCase, self).setUp()
+        self.index_dir = mkdtemp()
+        self.settings_override = override_settings(FACETS_INDEX_DIR=self.index_dir)
+        self.settings_override.enable()
+
+    def tearDown(self):
+        self.settings_override.disable()
+        rmtree(self.index_dir)
+        super(HashIndexTestCase, self).tearDown()
+
+    def test_unchanged(self):
+        result = self.collectstatic()
+        self.assertTrue(os.path.exists(os.path.join(self.index_dir, 'hashes.json')))
+
+        self.assertIn(finders.find('img/logo.png'), HashIndex())
+
+        # Files are not read again on next run
+        staticfiles_storage._wrapped = empty
+
+        class Copy(storages.TemporaryCopy):
+            def __init__(self, *args, **kwargs):
+                raise AssertionError('File should not be copied.')
+
+        original, storages.TemporaryCopy = storages.TemporaryCopy, Copy
+        try:
+            self.assertEqual(
+                self.collectstatic(),
+                [(path, hashed_name, False) for path, hashed_name, processed in result
+                 if path != 'css/all.css']
+            )
+        finally:
+            storages.TemporaryCopy = original
+
+    def test_command(self):
+        self.collectstatic()
+
+        out = StringIO()
+        call_command('facetsindex', stdout=out)
+        self.assertIn('0 outdated, 0 invalid', out.getvalue())
+
+        index = HashIndex()
+        index[finders.find('img/logo.png')]['md5'] = '0' * 32
+        index.save()
+        self.assertRaises(Exception, call_command, 'facetsindex', stdout=StringIO(),
+                          stderr=StringIO())
+
+        call_command('facetsindex', rebuild=True, stdout=StringIO())
+        call_command('facetsindex', stdout=StringIO())
+
+
+class ProcessorCacheTestCase(StorageTestCase):
+    def setUp(self):
+        super(ProcessorCacheTestCase, self).setUp()
+        self.cache_dir = mkdtemp()
+        self.settings_override = override_settings(
+            FACETS_PROCESSOR_CACHE=self.cache_dir,
+            FACETS_HANDLERS=(
+                'facets.processors.css.CssUrlsProcessor',
+                'facets.processors.gz.GZipProcessor',
+            )
+        )
+        self.settings_override.enable()
+        default_handlers._setup()
+
+    def tearDown(self):
+        self.settings_override.disable()
+        rmtree(self.cache_dir)
+        super(ProcessorCacheTestCase, self).tearDown()
+
+    def test_cache(self):
+        self.collectstatic()
+        hashed_name = staticfiles_storage.file_cache['css/print.css']
+        with staticfiles_storage.open(hashed_name + '.gz') as fp:
+            contents = fp.read()
+
+        # Results come from cache on a fresh STATIC_ROOT
+        super(ProcessorCacheTestCase, self).tearDown()
+        staticfiles_storage._wrapped = empty
+
+        def process_contents(self, contents):
+            raise AssertionError('Processor should not run.')
+
+        original, GZipProcessor.process_contents = GZipProcessor.process_contents, process_contents
+        try:
+            self.collectstatic()
+        finally:
+            GZipProcessor.process_contents = original
+
+        with staticfiles_storage.open(hashed_name + '.gz') as fp:
+            self.assertEqual(fp.read(), contents)
+
+    def test_cull(self):
+        cache = DiskCache(self.cache_dir, 10)
+        cache.set('aa1', b'12345')
+        cache.set('aa2', b'12345')
+        os.utime(cache.path('aa1'), (0, 0))
+        cache.set('aa3', b'12345')
+        cache.cull()
+
+        self.assertEqual(cache.get('aa1'), None)
+        self.assertEqual(cache.get('aa3'), b'12345')
+
+
+class ProcessorPipelineTestCase(StorageTestCase):
+    def setUp(self):
+        super(ProcessorPipelineTestCase, self).setUp()
+        self.settings_override = override_settings(FACETS_HANDLERS=(
+            'facets.processors.css.CssUrlsProcessor',
+            'tests.handlers.UpperCssProcessor',
+            'facets.processors.gz.GZipProcessor',
+        ))
+        self.settings_override.enable()
+        default_handlers._setup()
+
+    def tearDown(self):
+        self.settings_override.disable()
+        super(ProcessorPipelineTestCase, self).tearDown()
+
+    def test_pipeline(self):
+        storage = staticfiles_storage
+        storage._setup()
+        saved = []
+        original = storage._wrapped.save
+
+        def save(name, content):
+            saved.append(name)
+            return original(name, content)
+
+        storage._wrapped.save = save
+        self.collectstatic()
+
+        # Processed file and its compressed copy are written once
+        hashed_name = storage.file_cache['css/screen.css']
+        self.assertEqual(sorted(x for x in saved if x.startswith(hashed_name)),
+                         [hashed_name, hashed_name + '.gz'])
+
+        with storage.open(hashed_name) as fp:
+            contents = fp.read()
+        self.assertEqual(contents, contents.upper())
+        self.assertIn(storage.file_cache['img/logo.png'].upper().encode('utf-8'), contents)
+
+        with storage.open(hashed_name + '.gz') as fp:
+            self.assertEqual(GzipFile(fileobj=fp).read(), contents)
+
+
+class CommandProcessorTestCase(StorageTestCase):
+    def process(self, command):
+        processor = UglifyJsProcessor(None, staticfiles_storage, 'js/file.js',
+                                      program=sys.executable, command=command)
+        return processor.process_contents(b'var a;')
+
+    def test_stdin(self):
+        self.assertEqual(self.process(
+            '{program} -c "import sys; sys.stdout.write(sys.stdin.read().upper())"'
+        ), b'VAR A;')
+
+    def test_infile(self):
+        self.assertEqual(self.process(
+            '{program} -c "import sys; sys.stdout.write(open(sys.argv[1]).read().upper())" {infile}'
+        ), b'VAR A;')
+
+        # File changed in place
+        self.assertEqual(self.process(
+            '{program} -c "import sys; d = open(sys.argv[1]).read(); '
+            'open(sys.argv[1], \'w\').write(d.upper())" {infile}'
+        ), b'VAR A;')
+
+    def test_outfile(self):
+        self.assertEqual(self.process(
+            '{program} -c "import sys; d = open(sys.argv[1]).read(); print(42); '
+            'open(sys.argv[2], \'w\').write(d.upper())" {infile} {outfile}'
+        ), b'VAR A;')
+
+
+class PrecompressTestCase(StorageTestCase):
+    def setUp(self):
+        super(PrecompressTestCase, self).setUp()
+        self.settings_override = override_settings(FACETS_HANDLERS=(
+            'facets.processors.css.CssUrlsProcessor',
+            ('facets.processors.gz.PrecompressProcessor', {
+                'encodings': ('gzip', 'deflate'), 'min_size': 0, 'max_ratio': None
+            }),
+        ))
+        self.settings_override.enable()
+        default_handlers._setup()
+
+    def tearDown(self):
+        self.settings_override.disable()
+        super(PrecompressTestCase, self).tearDown()
+
+    def test_variants(self):
+        self.collectstatic()
+        storage = staticfiles_storage
+        hashed_name = storage.file_cache['css/print.css']
+
+        self.assertEqual(storage.get_variants('css/print.css'), ['.gz', '.zz'])
+        self.assertEqual(storage.get_variants('img/logo.png'), [])
+
+        with storage.open(hashed_name) as fp:
+            contents = fp.read()
+        with storage.open(hashed_name + '.zz') as fp:
+            self.assertEqual(zlib.decompress(fp.read()), contents)
+
+        # Compressed files only depend on contents
+        with storage.open(hashed_name + '.gz') as fp:
+            self.assertEqual(fp.read(), compress_gzip(contents, 9))
+
+    def test_idempotent(self):
+        self.collectstatic()
+        storage = staticfiles_storage
+        hashed_name = storage.file_cache['css/all.css']
+        with storage.open(hashed_name) as fp:
+            contents = fp.read()
+
+        def process_contents(self, contents):
+            raise AssertionError('Processor should not run.')
+
+        # Collection is written and copied again but its hashed file is already processed
+        storage.delete('css/all.css')
+        original = PrecompressProcessor.process_contents
+        PrecompressProcessor.process_contents = process_contents
+        try:
+            self.collectstatic()
+        finally:
+            PrecompressProcessor.process_contents = original
+
+        with storage.open(hashed_name) as fp:
+            self.assertEqual(fp.read(), contents)
+        self.assertEqual(storage.get_variants('css/all.css'), ['.gz', '.zz'])
+
+        # Processors run again when a file they created is missing
+        storage.delete('css/all.css')
+        storage.delete(hashed_name + '.gz')
+        self.collectstatic()
+        self.assertTrue(storage.exists(hashed_name + '.gz'))
+
+    def test_thresholds(self):
+        contents = b'body { color: red; }\n' * 100
+        processor = PrecompressProcessor({}, staticfiles_storage, 'css/big.css')
+        processor.process_contents(contents)
+        self.assertIn('.gz', processor.outputs)
+
+        # Too small
+        processor = PrecompressProcessor({}, staticfiles_storage, 'css/big.css', min_size=4096)
+        processor.process_contents(contents)
+        self.assertEqual(processor.outputs, {})
+
+        # Not compressible enough
+        processor = PrecompressProcessor({}, staticfiles_storage, 'css/big.css', min_size=0)
+        processor.process_contents(os.urandom(2048))
+        self.assertEqual(processor.outputs, {})
+
+    def test_stale(self):
+        storage = staticfiles_storage
+        storage.save('css/big.css.gz', ContentFile(b'stale'))
+
+        # Copy of a file now too small to be compressed is deleted
+        processor = PrecompressProcessor({}, storage, 'css/big.css', min_size=4096)
+        processor.run_contents(b'body { color: red; }\n')
+        self.assertFalse(storage.exists('css/big.css.gz'))
+
+    def test_match(self):
+        self.assertTrue(default_handlers.get_processors({}, staticfiles_storage, 'css/file.css'))
+        self.assertFalse(
+            default_handlers.get_processors({}, staticfiles_storage, 'css/file.css.map')
+        )
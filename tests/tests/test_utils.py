@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of Django facets released under the MIT license.
+# See the LICENSE for more information.
+from __future__ import (print_function, division, absolute_import, unicode_literals)
+
+import os
+import sys
+from tempfile import mkstemp
+import time
+
+from django.test.utils import override_settings
+from django.utils import unittest
+
+from facets.utils import (CommandError, CommandHandlerMixin, CssDependencies, CssUrlsIndex,
+                          MeasuredPopen, UrlsNormalizer, command_stats, parallel_map)
+from facets.workers import WorkerPool, close_pools
+from tests import ROOT
+
+CSS = """@import "base.css";
+@import url('print.css') print;
+h1 { background: url(../img/title.png?#iefix) }
+h2 { background: url("data:image/png;base64,AAAA") }
+h3 { background: url(http://example.com/bg.png) }
+"""
+
+
+class UrlsNormalizerTestCase(unittest.TestCase):
+    def test_scan(self):
+        urls = UrlsNormalizer('/static/').scan(CSS)
+        self.assertEqual([x[2] for x in urls], [
+            'base.css', 'print.css', '../img/title.png?#iefix',
+            'data:image/png;base64,AAAA', 'http://example.com/bg.png'
+        ])
+        self.assertEqual(CSS[urls[1][0]:urls[1][1]], "url('print.css')")
+
+    def test_normalize(self):
+        result = UrlsNormalizer('/static/').normalize(CSS, 'css')
+        self.assertIn('@import url("/static/css/base.css");', result)
+        self.assertIn('@import url("/static/css/print.css") print;', result)
+        self.assertIn('url("/static/img/title.png?#iefix")', result)
+        self.assertIn('url("data:image/png;base64,AAAA")', result)
+        self.assertIn('url(http://example.com/bg.png)', result)
+
+    def test_links(self):
+        self.assertEqual(
+            CssDependencies('/static/').get_links(CSS, 'css'),
+            set(['css/base.css', 'css/print.css', 'img/title.png'])
+        )
+
+    def test_index(self):
+        index = CssUrlsIndex()
+        urls = index.get(CSS)
+        self.assertTrue(index.get(CSS) is urls)
+        self.assertEqual(len(index.urls), 1)
+
+
+class WorkerHandler(CommandHandlerMixin):
+    worker = '{0} {1}'.format(sys.executable, os.path.join(ROOT, 'tests', 'worker.py'))
+
+    def __init__(self, command, **options):
+        self.command = command
+        self.__dict__.update(options)
+
+
+class WorkerTestCase(unittest.TestCase):
+    def tearDown(self):
+        close_pools()
+
+    def test_request(self):
+        self.assertEqual(WorkerHandler('{program} upper').execute_cmd(data=b'abc'), b'ABC')
+
+        # Worker is kept between requests
+        handler = WorkerHandler('{program} pid')
+        self.assertEqual(handler.execute_cmd(), handler.execute_cmd())
+
+    def test_error(self):
+        with self.assertRaises(CommandError):
+            WorkerHandler('{program} fail').execute_cmd()
+
+    def test_crash(self):
+        pid = WorkerHandler('{program} pid').execute_cmd()
+
+        fd, filename = mkstemp()
+        os.close(fd)
+        try:
+            WorkerHandler('{program} crash {infile}').execute_cmd(infile=filename)
+        finally:
+            os.path.exists(filename) and os.unlink(filename)
+
+        # Crashed worker was replaced
+        self.assertNotEqual(WorkerHandler('{program} pid').execute_cmd(), pid)
+
+    def test_timeout(self):
+        start = time.time()
+        with self.assertRaises(CommandError):
+            WorkerHandler('{program} sleep 10', timeout=0.5).execute_cmd()
+        self.assertLess(time.time() - start, 5)
+
+        # Killed worker was replaced, request was not sent again
+        self.assertEqual(WorkerHandler('{program} upper').execute_cmd(data=b'abc'), b'ABC')
+
+    def test_max_processes(self):
+        handler = WorkerHandler('{program} sleep 0.2')
+        with override_settings(FACETS_MAX_PROCESSES=1, FACETS_WORKER_POOL_SIZE=3):
+            start = time.time()
+            list(parallel_map(lambda x: handler.execute_cmd(), range(3), workers=3))
+            self.assertGreaterEqual(time.time() - start, 0.6)
+
+    def test_pool(self):
+        pool = WorkerPool(WorkerHandler.worker, 2)
+        try:
+            results = parallel_map(lambda x: pool.request(['pid'])[1], range(8), workers=4)
+            self.assertLessEqual(len(set(results)), 2)
+            self.assertLessEqual(len(pool.workers), 2)
+        finally:
+            pool.close()
+
+
+class CommandHandler(CommandHandlerMixin):
+    program = sys.executable
+
+    def __init__(self, code, **options):
+        self.command = '{program} -c "' + code + '"'
+        self.__dict__.update(options)
+
+
+class CommandHandlerTestCase(unittest.TestCase):
+    def setUp(self):
+        command_stats.reset()
+
+    def test_stats(self):
+        self.assertEqual(CommandHandler('print(42)').execute_cmd().strip(), b'42')
+
+        self.assertEqual(CommandHandler('print(42)').execute_cmd().strip(), b'42')
+
+        runs, wall, cpu, maxrss = command_stats.handlers['CommandHandler']
+        self.assertEqual(runs, 2)
+        self.assertGreater(wall, 0)
+        self.assertGreater(cpu, 0)
+        self.assertGreater(maxrss, 0)
+        self.assertTrue(command_stats.report()[0].startswith('CommandHandler: 2 run(s)'))
+
+    def test_kill(self):
+        p = MeasuredPopen([sys.executable, '-c', 'pass'])
+        p.wait()
+
+        # Reaped process is not signaled
+        CommandHandler('pass').kill_cmd(p)
+        self.assertEqual(p.returncode, 0)
+
+        # Process reaped by poll() is measured too
+        p = MeasuredPopen([sys.executable, '-c', 'pass'])
+        while p.poll() is None:
+            time.sleep(0.01)
+        self.assertEqual(p.returncode, 0)
+        self.assertIsNotNone(p.rusage)
+
+        p = MeasuredPopen([sys.executable, '-c', 'import time; time.sleep(10)'])
+        CommandHandler('pass').kill_cmd(p)
+        self.assertLess(p.wait(), 0)
+
+    def test_timeout(self):
+        start = time.time()
+        with self.assertRaises(CommandError):
+            CommandHandler('import time; time.sleep(10)', timeout=0.5).execute_cmd()
+        self.assertLess(time.time() - start, 5)
+
+    def test_max_processes(self):
+        handler = CommandHandler('import time; time.sleep(0.2)')
+        with override_settings(FACETS_MAX_PROCESSES=1):
+            start = time.time()
+            list(parallel_map(lambda x: handler.execute_cmd(), range(3), workers=3))
+            self.assertGreaterEqual(time.time() - start, 0.6)
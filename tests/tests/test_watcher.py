@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of Django facets released under the MIT license.
+# See the LICENSE for more information.
+from __future__ import (print_function, division, absolute_import, unicode_literals)
+
+import os
+
+from django.conf import settings
+from django.test.utils import override_settings
+
+from facets.watcher import PollingObserver, Watcher
+from tests import ROOT
+from tests.handlers import UpperLessCompiler
+
+from .base import TestCase
+
+
+@override_settings(FACETS_ENABLED=False, FACETS_HANDLERS=('tests.handlers.UpperLessCompiler',))
+class WatcherTestCase(TestCase):
+    def test_graph(self):
+        watcher = Watcher()
+        watcher.build_graph()
+
+        included = os.path.join(ROOT, 'tests/static/less/included.less')
+        self.assertEqual(
+            sorted(x.path for x in watcher.graph[included]),
+            ['less/deps.less', 'less/included.less']
+        )
+        deps = os.path.join(ROOT, 'tests/static/less/deps.less')
+        self.assertEqual([x.path for x in watcher.graph[deps]], ['less/deps.less'])
+
+        # Imports of every file are known
+        self.assertEqual(watcher.unknown, [])
+
+    def test_polling(self):
+        location = os.path.join(ROOT, 'tests/static/less')
+        observer = PollingObserver([location], 0)
+        self.assertEqual(observer.wait(), set())
+
+        filename = os.path.join(location, 'included.less')
+        st = os.stat(filename)
+        os.utime(filename, (st.st_atime, st.st_mtime + 3600))
+        try:
+            self.assertEqual(observer.wait(), set([filename]))
+            self.assertEqual(observer.wait(), set())
+        finally:
+            os.utime(filename, (st.st_atime, st.st_mtime))
+
+    def test_changes(self):
+        location = os.path.join(ROOT, 'tests/static/less')
+        observer = PollingObserver([location], 0)
+        watcher = Watcher()
+        watcher.build_graph()
+        self.assertEqual(observer.wait(), set())
+
+        # Compilers of files importing a changed file run again
+        filename = os.path.join(location, 'included.less')
+        st = os.stat(filename)
+        os.utime(filename, (st.st_atime, st.st_mtime + 3600))
+        count = UpperLessCompiler.count
+        try:
+            watcher.process_changes(observer.wait())
+        finally:
+            os.utime(filename, (st.st_atime, st.st_mtime))
+
+        self.assertEqual(UpperLessCompiler.count, count + 2)
+        for name in ('less/deps.css', 'less/included.css'):
+            self.assertTrue(os.path.isfile(os.path.join(settings.STATIC_ROOT, name)))
@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of Django facets released under the MIT license.
+# See the LICENSE for more information.
+from __future__ import (print_function, division, absolute_import, unicode_literals)
+
+import json
+import os
+import struct
+import sys
+import time
+
+
+def read_frame(fp):
+    size = fp.read(4)
+    if len(size) != 4:
+        sys.exit(0)
+    return fp.read(struct.unpack(b'>I', size)[0])
+
+
+def write_frame(fp, data):
+    fp.write(struct.pack(b'>I', len(data)))
+    fp.write(data)
+
+
+def main():
+    """
+    A stand-in worker process. Commands are:
+
+    * ``upper``: returns request data upper case;
+    * ``pid``: returns worker process id;
+    * ``sleep <seconds>``: returns after ``seconds``;
+    * ``crash <filename>``: dies without response when ``filename`` exists, after removing it;
+    * ``fail``: returns an error.
+    """
+    stdin = getattr(sys.stdin, 'buffer', sys.stdin)
+    stdout = getattr(sys.stdout, 'buffer', sys.stdout)
+
+    while True:
+        args = json.loads(read_frame(stdin).decode('utf-8'))['args']
+        data = read_frame(stdin)
+
+        header, out = {'status': 0}, b''
+        if args[0] == 'upper':
+            out = data.upper()
+        elif args[0] == 'pid':
+            out = str(os.getpid()).encode('ascii')
+        elif args[0] == 'sleep':
+            time.sleep(float(args[1]))
+        elif args[0] == 'crash' and os.path.exists(args[1]):
+            os.unlink(args[1])
+            os._exit(1)
+        elif args[0] == 'fail':
+            header = {'status': 1, 'error': 'failure'}
+
+        write_frame(stdout, json.dumps(header).encode('utf-8'))
+        write_frame(stdout, out)
+        stdout.flush()
+
+
+if __name__ == '__main__':
+    main()